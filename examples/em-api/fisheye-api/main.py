@@ -1,146 +1,469 @@
 #!/usr/bin/env python3
-import urllib.request
 import json
 import zipfile
-import io
 import os
 import struct
-from collections import Counter
+import math
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import image_io
+from image_io import (
+    IMAGE_LIMIT,
+    FileWriter,
+    load_manifest,
+    mapped_images,
+    save_manifest,
+    spool_all_images,
+    stream_recent_images,
+    sync_images,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # Configuration
-API_BASE = "http://satellite-telemetry.dphi-tm/api/images"
 OUTPUT_DIR = "/data"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+# "recent" fetches the IMAGE_LIMIT latest images, "incremental" only fetches
+# the images missing from OUTPUT_DIR according to image_io.MANIFEST_PATH,
+# "archive" spools the ZIP of every image to image_io.SPOOL_PATH and maps it
+SYNC_MODE = os.environ.get("SYNC_MODE", "recent")
+# Results of already analyzed images are reused across runs, 0 disables it
+CACHE_DIR = os.path.join(OUTPUT_DIR, "cache")
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_MB", "64")) * 1024 * 1024
+CACHE_INVALIDATE = os.environ.get("CACHE_INVALIDATE", "0") == "1"
+# Bump whenever the analysis changes so stale cache entries are not reused
+ANALYZER_VERSION = "3"
+# Byte histograms are counted with NumPy when it is installed, with the C
+# counting loop of collections.Counter otherwise
+BYTE_ENGINE = os.environ.get("BYTE_ENGINE", "numpy" if np is not None else "stdlib")
+# Bytes per block of the entropy profile of each image
+ENTROPY_BLOCK_SIZE = int(os.environ.get("ENTROPY_BLOCK_KB", "64")) * 1024
+# Maximum number of raw images waiting to be written
+QUEUE_DEPTH = int(os.environ.get("QUEUE_DEPTH", "8"))
+# Flush written files to the storage every FSYNC_BATCH files, 0 leaves it to the OS
+FSYNC_BATCH = int(os.environ.get("FSYNC_BATCH", "0"))
+# Processes analyzing images in parallel, 1 analyzes them in the main process
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", str(os.cpu_count() or 1)))
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_COLOR_TYPES = {
+    0: "Grayscale",
+    2: "RGB",
+    3: "Palette",
+    4: "Grayscale+Alpha",
+    6: "RGBA",
+}
+# JPEG start-of-frame markers; C4 (DHT), C8 (JPG) and CC (DAC) are not frames
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# EXIF tags: DateTime (IFD0), ExifIFD pointer, DateTimeOriginal/Digitized
+EXIF_TIMESTAMP_TAGS = {
+    0x0132: "datetime",
+    0x9003: "datetime_original",
+    0x9004: "datetime_digitized",
+}
+EXIF_IFD_POINTER = 0x8769
+# First read of a header; doubled while the header runs past it
+HEADER_READ_SIZE = 64 * 1024
+
+
+class TruncatedHeader(Exception):
+    """The headers continue past the bytes available"""
+
+
+def _unpack(fmt, view, offset):
+    if offset + struct.calcsize(fmt) > len(view):
+        raise TruncatedHeader()
+    return struct.unpack_from(fmt, view, offset)
+
+
+def read_exif_timestamps(view):
+    """DateTime fields of a TIFF-structured EXIF block, as "YYYY:MM:DD HH:MM:SS"
+
+    `view` is the whole EXIF block, so an offset past its end means the block
+    is corrupt rather than truncated: no timestamps are returned and the rest
+    of the header is still parsed.
+    """
+    try:
+        order = {b"II": "<", b"MM": ">"}[bytes(view[:2])]
+    except KeyError:
+        return {}
+
+    timestamps = {}
+    try:
+        pending = [_unpack(order + "I", view, 4)[0]]
+        seen = set()
+        while pending:
+            ifd = pending.pop()
+            if ifd in seen or ifd + 2 > len(view):
+                continue
+            seen.add(ifd)
+            (count,) = _unpack(order + "H", view, ifd)
+            for entry in range(ifd + 2, ifd + 2 + 12 * count, 12):
+                tag, kind, length, value = _unpack(order + "HHII", view, entry)
+                if tag == EXIF_IFD_POINTER:
+                    pending.append(value)
+                elif tag in EXIF_TIMESTAMP_TAGS and kind == 2:
+                    # ASCII values up to 4 bytes are stored in the entry itself
+                    start = entry + 8 if length <= 4 else value
+                    if start + length > len(view):
+                        continue
+                    text = bytes(view[start : start + length]).split(b"\0", 1)[0]
+                    timestamps[EXIF_TIMESTAMP_TAGS[tag]] = text.decode(
+                        "ascii", "replace"
+                    )
+    except TruncatedHeader:
+        return {}
+    return timestamps
+
+
+def read_png_metadata(view):
+    """Metadata of the PNG chunks before the image data
+
+    IHDR, tEXt, tIME and eXIf chunks are read in place from `view` (bytes or
+    a memoryview); parsing stops at the first IDAT chunk, so the image data
+    is never touched.
+    """
+    view = memoryview(view)
+    if bytes(view[:8]) != PNG_SIGNATURE:
+        return {"error": "Not a valid PNG file"}
 
+    stats = {}
+    text = {}
+    pos = 8
+    while True:
+        length, chunk_type = _unpack(">I4s", view, pos)
+        if chunk_type == b"IDAT" or chunk_type == b"IEND":
+            break
+        data_end = pos + 8 + length
+        if data_end > len(view):
+            raise TruncatedHeader()
+        data = view[pos + 8 : data_end]
 
-def fetch_image_list():
-    """Fetch list of available images"""
-    print("Fetching image list...")
-    req = urllib.request.Request(f"{API_BASE}/list")
-    with urllib.request.urlopen(req) as response:
-        data = response.read()
-        return json.loads(data)
-
-
-def fetch_specific_images(image_names):
-    """Fetch specific images as ZIP"""
-    print(f"Fetching {len(image_names)} images...")
-    payload = json.dumps({"images": image_names}).encode("utf-8")
-    req = urllib.request.Request(
-        API_BASE, data=payload, headers={"Content-Type": "application/json"}
-    )
-    with urllib.request.urlopen(req) as response:
-        return response.read()
+        if chunk_type == b"IHDR":
+            width, height, bit_depth, color_type = _unpack(">IIBB", data, 0)
+            stats["width"] = width
+            stats["height"] = height
+            stats["bit_depth"] = bit_depth
+            stats["color_type"] = PNG_COLOR_TYPES.get(color_type, "Unknown")
+            stats["total_pixels"] = width * height
+        elif chunk_type == b"tEXt":
+            keyword, _, value = bytes(data).partition(b"\0")
+            text[keyword.decode("latin-1")] = value.decode("latin-1")
+        elif chunk_type == b"tIME":
+            stats["modified"] = "%04d-%02d-%02dT%02d:%02d:%02d" % _unpack(
+                ">HBBBBB", data, 0
+            )
+        elif chunk_type == b"eXIf":
+            stats.update(read_exif_timestamps(data))
 
+        pos = data_end + 4  # CRC
 
-def fetch_recent_images(limit=10):
-    """Fetch recent images with limit"""
-    print(f"Fetching {limit} recent images...")
-    payload = json.dumps({"limit": limit}).encode("utf-8")
-    req = urllib.request.Request(
-        API_BASE, data=payload, headers={"Content-Type": "application/json"}
-    )
-    with urllib.request.urlopen(req) as response:
-        return response.read()
+    if text:
+        stats["text"] = text
+    return stats
 
 
-def extract_images(zip_data):
-    """Extract images from ZIP data"""
-    images = []
-    with zipfile.ZipFile(io.BytesIO(zip_data)) as zf:
-        for filename in zf.namelist():
-            if filename.lower().endswith((".png", ".jpg", ".jpeg")):
-                with zf.open(filename) as img_file:
-                    img_data = img_file.read()
-                    images.append((filename, img_data))
-    return images
+def read_jpeg_metadata(view):
+    """Dimensions and EXIF timestamps of a JPEG, up to its start-of-frame
 
+    Marker segments are walked in place over `view` and parsing stops at the
+    SOFn segment, before any entropy-coded data.
+    """
+    view = memoryview(view)
+    if bytes(view[:2]) != b"\xff\xd8":
+        return {"error": "Not a valid JPEG file"}
 
-def read_png_metadata(png_data):
-    """Extract basic PNG metadata without external libraries"""
     stats = {}
-
-    # PNG signature check
-    if png_data[:8] != b"\x89PNG\r\n\x1a\n":
-        return {"error": "Not a valid PNG file"}
-
-    pos = 8
-    while pos < len(png_data):
-        # Read chunk length and type
-        if pos + 8 > len(png_data):
-            break
-        length = struct.unpack(">I", png_data[pos : pos + 4])[0]
-        chunk_type = png_data[pos + 4 : pos + 8].decode("ascii", errors="ignore")
-
-        if chunk_type == "IHDR":
-            # Image header chunk
-            width, height = struct.unpack(">II", png_data[pos + 8 : pos + 16])
-            bit_depth = png_data[pos + 16]
-            color_type = png_data[pos + 17]
+    pos = 2
+    while True:
+        marker_byte, marker = _unpack("BB", view, pos)
+        if marker_byte != 0xFF:
+            return dict(stats, error="Corrupt JPEG marker")
+        if marker == 0xFF:
+            # Fill bytes may precede a marker
+            pos += 1
+            continue
+        if marker == 0xD9 or marker == 0xDA:
+            # End of image or start of scan without a frame header
+            return stats
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+
+        (length,) = _unpack(">H", view, pos + 2)
+        segment_end = pos + 2 + length
+        if segment_end > len(view):
+            raise TruncatedHeader()
+        segment = view[pos + 4 : segment_end]
+
+        if marker == 0xE1 and bytes(segment[:6]) == b"Exif\0\0":
+            stats.update(read_exif_timestamps(segment[6:]))
+        elif marker in JPEG_SOF_MARKERS:
+            precision, height, width, components = _unpack(">BHHB", segment, 0)
             stats["width"] = width
             stats["height"] = height
-            stats["bit_depth"] = bit_depth
-            stats["color_type"] = (
-                ["Grayscale", "RGB", "Palette", "Grayscale+Alpha", "RGBA"][color_type]
-                if color_type < 5
-                else "Unknown"
+            stats["bit_depth"] = precision
+            stats["color_type"] = {1: "Grayscale", 3: "YCbCr", 4: "CMYK"}.get(
+                components, "Unknown"
             )
             stats["total_pixels"] = width * height
+            stats["progressive"] = marker in (0xC2, 0xC6, 0xCA, 0xCE)
+            return stats
+        pos = segment_end
+
+
+def image_format(data):
+    if bytes(data[:4]) == b"\x89PNG":
+        return "PNG"
+    if bytes(data[:3]) == b"\xff\xd8\xff":
+        return "JPEG"
+    return "Unknown"
+
 
-        # Move to next chunk
-        pos += 12 + length  # length + type + data + CRC
+METADATA_READERS = {"PNG": read_png_metadata, "JPEG": read_jpeg_metadata}
 
+
+def read_image_metadata(data):
+    """Format and header metadata of an image held in memory, without copying it"""
+    view = memoryview(data)
+    stats = {"format": image_format(view)}
+    if stats["format"] in METADATA_READERS:
+        try:
+            stats.update(METADATA_READERS[stats["format"]](view))
+        except TruncatedHeader:
+            stats["error"] = "Truncated image header"
+    return stats
+
+
+def read_header_metadata(f, read_size=HEADER_READ_SIZE):
+    """Metadata of the image readable from file object `f`, reading only its headers
+
+    The first `read_size` bytes are parsed, and more are read only while the
+    headers continue past them.
+    """
+    data = f.read(read_size)
+    stats = {"format": image_format(data)}
+    reader = METADATA_READERS.get(stats["format"])
+    while reader is not None:
+        try:
+            stats.update(reader(data))
+            break
+        except TruncatedHeader:
+            more = f.read(len(data))
+            if not more:
+                stats["error"] = "Truncated image header"
+                break
+            data += more
     return stats
 
 
+def zip_image_metadata(zip_file):
+    """{filename: metadata} of the images of a ZIP archive, without extracting them
+
+    `zip_file` is a path or a seekable file object, e.g. io.BytesIO over the
+    buffered /api/images response. Only the central directory and the first
+    bytes of every member are read, so STORED members are never read whole.
+    """
+    metadata = {}
+    with zipfile.ZipFile(zip_file) as zf:
+        for info in zf.infolist():
+            if not info.filename.lower().endswith((".png", ".jpg", ".jpeg")):
+                continue
+            with zf.open(info) as member:
+                stats = read_header_metadata(member)
+            stats["size_bytes"] = info.file_size
+            metadata[info.filename] = stats
+    return metadata
+
+
+def block_histograms(data, block_size=ENTROPY_BLOCK_SIZE, engine=BYTE_ENGINE):
+    """256-bin byte histogram of every `block_size` block of `data`
+
+    Returns a list of rows; the last block may be shorter.
+    """
+    view = memoryview(data)
+    if engine == "numpy":
+        values = np.frombuffer(view, dtype=np.uint8)
+        return [
+            np.bincount(values[start : start + block_size], minlength=256)
+            for start in range(0, len(values), block_size)
+        ]
+    if engine != "stdlib":
+        raise ValueError(f"Unknown BYTE_ENGINE: {engine}")
+
+    rows = []
+    for start in range(0, len(view), block_size):
+        counts = Counter(view[start : start + block_size])
+        rows.append([counts.get(value, 0) for value in range(256)])
+    return rows
+
+
+def shannon_entropy(histogram):
+    """Entropy in bits per byte of a 256-bin histogram"""
+    total = sum(histogram)
+    return 0.0 - sum(
+        count / total * math.log2(count / total) for count in histogram if count
+    )
+
+
+def byte_statistics(data, block_size=ENTROPY_BLOCK_SIZE, engine=BYTE_ENGINE):
+    """Shannon entropy, byte moments and per-block entropy profile of `data`"""
+    if not data:
+        return {"unique_bytes": 0, "entropy_bits_per_byte": 0.0}
+
+    rows = block_histograms(data, block_size, engine)
+    if engine == "numpy":
+        histogram = np.sum(rows, axis=0)
+        counts = np.stack(rows).astype(np.float64)
+        p = counts / counts.sum(axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            profile = (0.0 - np.nansum(p * np.log2(p), axis=1)).tolist()
+        histogram = histogram.tolist()
+    else:
+        histogram = [sum(column) for column in zip(*rows)]
+        profile = [shannon_entropy(row) for row in rows]
+
+    total = len(data)
+    mean = sum(value * count for value, count in enumerate(histogram)) / total
+    variance = (
+        sum((value - mean) ** 2 * count for value, count in enumerate(histogram))
+        / total
+    )
+    return {
+        "unique_bytes": sum(1 for count in histogram if count),
+        "entropy_bits_per_byte": shannon_entropy(histogram),
+        "mean_byte": mean,
+        "std_byte": math.sqrt(variance),
+        "entropy_profile": {
+            "block_size": block_size,
+            "min": min(profile),
+            "max": max(profile),
+            "mean": sum(profile) / len(profile),
+            "blocks": [round(value, 4) for value in profile],
+        },
+    }
+
+
 def analyze_image(filename, img_data):
     """Perform basic image analysis using stdlib only"""
     stats = {"filename": filename, "size_bytes": len(img_data)}
 
-    # Detect file type
-    if img_data.startswith(b"\x89PNG"):
-        stats["format"] = "PNG"
-        stats.update(read_png_metadata(img_data))
-    elif img_data.startswith(b"\xff\xd8\xff"):
-        stats["format"] = "JPEG"
-        # Basic JPEG size detection would be complex without PIL
-        stats["note"] = "JPEG metadata extraction limited without libraries"
-    else:
-        stats["format"] = "Unknown"
+    # Detect file type and read the headers in place
+    stats.update(read_image_metadata(img_data))
 
-    # Calculate basic file statistics
-    byte_counter = Counter(img_data)
-    stats["unique_bytes"] = len(byte_counter)
-    stats["entropy_estimate"] = len(byte_counter) / 256.0  # Rough entropy indicator
+    # Byte histogram, entropy and entropy profile of the file
+    stats.update(byte_statistics(img_data))
 
     return stats
 
 
+def analyze_images(images, cache=None, workers=ANALYSIS_WORKERS):
+    """Yield (filename, img_data, stats, cached) for every image, in order
+
+    With more than one worker, images are analyzed in a process pool while
+    the next ones are downloaded. At most two images per worker are in
+    flight, so memory stays bounded however long the batch is.
+    """
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    pending = deque()
+
+    def finish():
+        filename, img_data, stats, future, cached = pending.popleft()
+        if future is not None:
+            stats = future.result()
+        if not cached and cache is not None:
+            cache.put(img_data, stats)
+        return filename, img_data, stats, cached
+
+    try:
+        for filename, img_data in images:
+            stats = cache.get(img_data) if cache is not None else None
+            if stats is not None:
+                pending.append((filename, img_data, stats, None, True))
+            elif pool is not None:
+                # Slices of a mapped archive cannot be pickled
+                future = pool.submit(analyze_image, filename, bytes(img_data))
+                pending.append((filename, img_data, None, future, False))
+            else:
+                stats = analyze_image(filename, img_data)
+                pending.append((filename, img_data, stats, None, False))
+            while len(pending) > 2 * workers:
+                yield finish()
+        while pending:
+            yield finish()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
 def main():
     insights = {"total_images_processed": 0, "images": {}}
 
     # Option 1: Fetch specific images
-    # zip_data = fetch_specific_images(["20251031.png", "20251030.png"])
-
-    # Option 2: Fetch recent images (using this as default)
-    zip_data = fetch_recent_images(limit=10)
-
-    # Extract and process images
-    images = extract_images(zip_data)
-    print(f"Extracted {len(images)} images")
-
-    for filename, img_data in images:
-        print(f"Processing {filename}...")
-        stats = analyze_image(filename, img_data)
+    # zip_data = image_io.fetch_specific_images(["20251031.png", "20251030.png"])
+
+    # Option 2: Fetch recent images
+    # zip_data = image_io.fetch_recent_images(limit=10)
+
+    # Options 1 and 2 buffer the whole ZIP in memory before extracting it
+    # images = image_io.extract_images(zip_data)
+    # Dimensions and timestamps alone can be listed without extracting it
+    # metadata = zip_image_metadata(io.BytesIO(zip_data))
+
+    # Option 3: Stream images one at a time (using this as default), either the
+    # most recent ones or only those missing from OUTPUT_DIR
+    manifest = load_manifest()
+    if SYNC_MODE == "incremental":
+        images = sync_images(manifest)
+    elif SYNC_MODE == "archive":
+        images = mapped_images(spool_all_images())
+    else:
+        images = stream_recent_images(limit=IMAGE_LIMIT)
+
+    # Images analyzed in earlier runs are served from the pod volume
+    cache = None
+    if CACHE_MAX_BYTES > 0:
+        cache = image_io.ResultCache(CACHE_DIR, ANALYZER_VERSION, CACHE_MAX_BYTES)
+        if CACHE_INVALIDATE:
+            print("Invalidating result cache...")
+            cache.clear()
+
+    writer = FileWriter(queue_depth=QUEUE_DEPTH, fsync_batch=FSYNC_BATCH)
+    start = time.perf_counter()
+    for filename, img_data, stats, cached in analyze_images(images, cache):
+        print(f"Processed {filename}{' (cached)' if cached else ''}")
         insights["images"][filename] = stats
 
-        # Save raw image file
+        # Save raw image file in the background
         img_path = os.path.join(OUTPUT_DIR, filename)
-        with open(img_path, "wb") as f:
-            f.write(img_data)
-        print(f"  Saved image to {img_path}")
-
-    insights["total_images_processed"] = len(images)
+        writer.submit(img_path, img_data)
+        manifest[filename] = len(img_data)
+
+    writer.close()
+
+    # Record what is on the volume now so the next incremental run skips it
+    save_manifest(manifest)
+
+    insights["total_images_processed"] = len(insights["images"])
+    insights["writes"] = writer.stats
+    insights["byte_statistics"] = {
+        "engine": BYTE_ENGINE,
+        "workers": ANALYSIS_WORKERS,
+        "block_size": ENTROPY_BLOCK_SIZE,
+        "wall_time_seconds": time.perf_counter() - start,
+    }
+    if cache is not None:
+        insights["cache"] = {
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "size_bytes": cache.evict(),
+        }
 
     # Save insights to JSON
     insights_path = os.path.join(OUTPUT_DIR, "insights.json")
@@ -150,6 +473,11 @@ def main():
     print(f"\nProcessing complete!")
     print(f"Insights saved to: {insights_path}")
     print(f"Total images processed: {insights['total_images_processed']}")
+    print(
+        f"Images written: {writer.stats['files_written']} "
+        f"({writer.stats['bytes_written'] / 1e6:.1f} MB), unchanged: "
+        f"{writer.stats['files_skipped']} ({writer.stats['bytes_skipped'] / 1e6:.1f} MB)"
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+import sys
+import os
+import io
+import json
+import time
+import resource
+import subprocess
+import tempfile
+import threading
+import zipfile
+import importlib.util
+import http.server
+import numpy as np
+from PIL import Image
+import image_io
+
+# Configuration
+OUTPUT_DIR = "/data"
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Analyzers to measure: fisheye.py with ANALYZER_BACKEND "torch" or "numpy",
+# and "stdlib" for analyze_image of the em-api fisheye example
+BACKENDS = os.environ.get("BENCH_BACKENDS", "torch,numpy,stdlib").split(",")
+BATCH_SIZES = [
+    int(size) for size in os.environ.get("BENCH_BATCH_SIZES", "1,4,8").split(",")
+]
+# Synthetic frames, IMAGES_PER_CASE of every resolution and format
+RESOLUTIONS = os.environ.get("BENCH_RESOLUTIONS", "512x512,1024x1024,2048x2048")
+FORMATS = os.environ.get("BENCH_FORMATS", "png,jpeg").split(",")
+IMAGES_PER_CASE = int(os.environ.get("BENCH_IMAGES", "8"))
+STDLIB_ANALYZER = os.environ.get(
+    "STDLIB_ANALYZER", os.path.join(HERE, "..", "em-api", "fisheye-api", "main.py")
+)
+REPORT_PATH = os.path.join(OUTPUT_DIR, "benchmark.json")
+
+
+def parse_resolutions(spec):
+    return [tuple(int(v) for v in item.split("x")) for item in spec.split(",")]
+
+
+def synthetic_frame(width, height, seed, fmt):
+    """Encoded fisheye-like frame: gradients and noise inside a circular lens"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    cx, cy = (width - 1) / 2, (height - 1) / 2
+    radius = min(width, height) / 2
+    r = np.hypot(xx - cx, yy - cy) / radius
+
+    # Horizontal and vertical gradients plus a vignette towards the lens edge
+    pixels = np.stack(
+        [255 * xx / width, 255 * yy / height, 255 * (1 - r).clip(0, 1)], axis=2
+    )
+    pixels += rng.normal(0, 12, pixels.shape)
+    pixels[r > 1] = 0
+
+    img = Image.fromarray(pixels.clip(0, 255).astype(np.uint8))
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt.upper(), **({"quality": 90} if fmt == "jpeg" else {}))
+    return buffer.getvalue()
+
+
+def generate_images():
+    """{filename: bytes} of every case, named <width>x<height>-<index>.<format>"""
+    images = {}
+    for width, height in parse_resolutions(RESOLUTIONS):
+        for fmt in FORMATS:
+            ext = "jpg" if fmt == "jpeg" else fmt
+            for idx in range(IMAGES_PER_CASE):
+                name = f"{width}x{height}-{idx:03d}.{ext}"
+                images[name] = synthetic_frame(width, height, idx, fmt)
+    return images
+
+
+class ImagesHandler(http.server.BaseHTTPRequestHandler):
+    """Local stand-in for the /api/images endpoints of the telemetry API"""
+
+    images = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/api/images/list":
+            return self.send(b"Not found", "text/plain", 404)
+        names = sorted(self.images, reverse=True)
+        body = {"success": True, "data": names, "count": len(names), "error": None}
+        self.send(json.dumps(body).encode("utf-8"), "application/json")
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        names = query.get("images") or sorted(self.images, reverse=True)
+        names = [name for name in names if name in self.images]
+        if query.get("limit"):
+            names = names[: query["limit"]]
+        if query.get("images") and len(names) == 1:
+            ext = names[0].rsplit(".", 1)[-1]
+            mime = "jpeg" if ext == "jpg" else ext
+            return self.send(self.images[names[0]], f"image/{mime}")
+
+        # Uncompressed, like the ZIPs of the real API
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+            for name in names:
+                zf.writestr(name, self.images[name])
+        self.send(buffer.getvalue(), "application/zip")
+
+
+def serve(images):
+    ImagesHandler.images = images
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ImagesHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentiles(values):
+    p50, p90, p99 = np.percentile(values, [50, 90, 99]).tolist()
+    return {"p50": p50, "p90": p90, "p99": p99, "max": max(values)}
+
+
+def count_histograms(data, block_size):
+    """block_histograms of the stdlib analyzer, with 256 bytes.count per block"""
+    values = [bytes((value,)) for value in range(256)]
+    return [
+        [block.count(value) for value in values]
+        for block in (
+            bytes(data[start : start + block_size])
+            for start in range(0, len(data), block_size)
+        )
+    ]
+
+
+def byte_counting(module, images):
+    """Seconds to count the byte histograms of every image, per stdlib method
+
+    The stdlib analyzer counts with one collections.Counter pass per block;
+    this times the C-level alternative of one bytes.count pass per value.
+    """
+    block_size = module.ENTROPY_BLOCK_SIZE
+    methods = {
+        "counter": lambda data: module.block_histograms(data, block_size, "stdlib"),
+        "bytes_count": lambda data: count_histograms(data, block_size),
+    }
+    report = {"bytes": sum(len(data) for _, data in images)}
+    for method, histograms in methods.items():
+        start = time.perf_counter()
+        for _, data in images:
+            histograms(data)
+        report[f"{method}_seconds"] = time.perf_counter() - start
+    return report
+
+
+def worker(backend, batch_size, api_base, result_path):
+    """Fetch every image from the stand-in API, then time the analyzer on them
+
+    Runs in its own process, so the peak RSS only covers this backend. Lens
+    circles detected on the synthetic frames go to a temporary file, not to
+    the LENS_PATH calibration of the real frames.
+    """
+    lens_dir = tempfile.TemporaryDirectory()
+    lens_path = os.path.join(lens_dir.name, "lens_circles.json")
+    load_start = time.perf_counter()
+    if backend == "stdlib":
+        module = load_module("stdlib_analyzer", STDLIB_ANALYZER)
+
+        def analyze(batch):
+            return [module.analyze_image(name, data) for name, data in batch]
+
+    else:
+        module = load_module("fisheye", os.path.join(HERE, "fisheye.py"))
+        if backend == "torch":
+            analyzer = module.ImageAnalyzer(module.device, lens_path=lens_path)
+        else:
+            analyzer = module.NumpyImageAnalyzer(lens_path=lens_path)
+
+        def analyze(batch):
+            return analyzer.analyze_batch(
+                [data for _, data in batch], batch_size=batch_size
+            )
+
+    load_seconds = time.perf_counter() - load_start
+    cuda = backend == "torch" and analyzer.cuda_used
+    torch = module.torch if cuda else None
+
+    # Through the streaming client the analyzers share, then timed separately
+    image_io.API_BASE = api_base
+    fetch_start = time.perf_counter()
+    listing = image_io.fetch_image_list()
+    cases = {}
+    for name, data in image_io.stream_recent_images(limit=listing["count"]):
+        resolution, rest = name.split("-", 1)
+        cases.setdefault((resolution, rest.rsplit(".", 1)[-1]), []).append(
+            (name, data)
+        )
+    fetch_seconds = time.perf_counter() - fetch_start
+
+    report = {
+        "backend": backend,
+        "batch_size": batch_size,
+        "load_seconds": load_seconds,
+        "fetch_seconds": fetch_seconds,
+        "cases": [],
+    }
+    for (resolution, fmt), images in sorted(cases.items()):
+        width, height = (int(v) for v in resolution.split("x"))
+        # Warm up kernels, allocator and cuDNN algorithm selection for this shape
+        analyze(images[:batch_size])
+        if cuda:
+            torch.cuda.reset_peak_memory_stats()
+
+        latencies = []
+        start = time.perf_counter()
+        for idx in range(0, len(images), batch_size):
+            batch = images[idx : idx + batch_size]
+            batch_start = time.perf_counter()
+            analyze(batch)
+            # Every image of a batch is only done once the whole batch is
+            latencies += [time.perf_counter() - batch_start] * len(batch)
+        elapsed = time.perf_counter() - start
+
+        case = {
+            "resolution": resolution,
+            "format": fmt,
+            "images": len(images),
+            "bytes": sum(len(data) for _, data in images),
+            "seconds": elapsed,
+            "images_per_second": len(images) / elapsed,
+            "mpx_per_second": len(images) * width * height / elapsed / 1e6,
+            "latency_ms": {
+                key: value * 1000 for key, value in percentiles(latencies).items()
+            },
+        }
+        if cuda:
+            case["peak_gpu_allocated_bytes"] = torch.cuda.max_memory_allocated()
+        if backend == "stdlib":
+            case["byte_counting"] = byte_counting(module, images)
+        report["cases"].append(case)
+
+    # ru_maxrss is in kilobytes on Linux
+    report["peak_rss_bytes"] = (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    )
+    with open(result_path, "w") as f:
+        json.dump(report, f)
+
+
+def run_worker(backend, batch_size, api_base, log_file):
+    """Run one backend and batch size in a fresh interpreter"""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        result_path = f.name
+    env = dict(os.environ)
+    if backend != "stdlib":
+        env["ANALYZER_BACKEND"] = backend
+    command = [sys.executable, os.path.abspath(__file__), "worker"]
+    command += [backend, str(batch_size), api_base, result_path]
+    try:
+        log_file.flush()
+        subprocess.run(command, env=env, stdout=log_file, stderr=log_file, check=True)
+        with open(result_path) as f:
+            return json.load(f)
+    except subprocess.CalledProcessError as e:
+        print(f"{backend} with batch size {batch_size} failed: {e}")
+        return None
+    finally:
+        os.remove(result_path)
+
+
+def main():
+    # Redirect stdout and stderr to log file
+    log_file = open(os.path.join(OUTPUT_DIR, "benchmark_log.txt"), "w")
+    sys.stdout = log_file
+    sys.stderr = log_file
+
+    print("Generating synthetic frames...")
+    images = generate_images()
+    print(f"{len(images)} frames, {sum(map(len, images.values())) / 1e6:.1f} MB")
+    server = serve(images)
+    api_base = f"http://127.0.0.1:{server.server_port}/api/images"
+
+    report = {
+        "config": {
+            "backends": BACKENDS,
+            "batch_sizes": BATCH_SIZES,
+            "resolutions": RESOLUTIONS.split(","),
+            "formats": FORMATS,
+            "images_per_case": IMAGES_PER_CASE,
+        },
+        "runs": [],
+    }
+    for backend in BACKENDS:
+        if backend == "stdlib" and not os.path.exists(STDLIB_ANALYZER):
+            print(f"Skipping stdlib: {STDLIB_ANALYZER} not found")
+            continue
+        # analyze_image handles one image at a time
+        for batch_size in [1] if backend == "stdlib" else BATCH_SIZES:
+            print(f"\nBenchmarking {backend}, batch size {batch_size}...")
+            run = run_worker(backend, batch_size, api_base, log_file)
+            if run is None:
+                continue
+            report["runs"].append(run)
+            for case in run["cases"]:
+                print(
+                    f"  {case['resolution']:>9} {case['format']:>4}: "
+                    f"{case['images_per_second']:7.2f} img/s, "
+                    f"{case['mpx_per_second']:8.2f} Mpx/s, "
+                    f"p50 {case['latency_ms']['p50']:8.1f} ms, "
+                    f"p99 {case['latency_ms']['p99']:8.1f} ms"
+                )
+                if "byte_counting" in case:
+                    counting = case["byte_counting"]
+                    print(
+                        f"    byte histograms: "
+                        f"Counter {counting['counter_seconds']:.3f} s, "
+                        f"bytes.count {counting['bytes_count_seconds']:.3f} s"
+                    )
+            print(f"  Peak RSS: {run['peak_rss_bytes'] / 1e6:.0f} MB")
+    server.shutdown()
+
+    with open(REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport saved to: {REPORT_PATH}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        worker(sys.argv[2], int(sys.argv[3]), sys.argv[4], sys.argv[5])
+    else:
+        main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Columnar, compressed form of cuda_insights.json for cheaper downlinks
+
+Per-image statistics are stored as a structured array with one typed column
+per field and the ResNet embeddings as a float16 matrix, in a single .npz
+file. Only NumPy is needed to read it back, so it can be decoded on the
+ground:
+
+    python3 compact_insights.py cuda_insights.npz cuda_insights.json
+"""
+import sys
+import io
+import json
+import numpy as np
+
+# Fields missing from some images (e.g. performance.cached) get a mask, and
+# so do fields that are null for some images (e.g. novelty.nearest_image)
+PRESENT_SUFFIX = "@present"
+NULL_SUFFIX = "@null"
+
+
+def flatten(stats, prefix=""):
+    """{"a": {"b": 1}} -> {"a.b": 1}"""
+    fields = {}
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            fields.update(flatten(value, f"{prefix}{key}."))
+        else:
+            fields[prefix + key] = value
+    return fields
+
+
+def unflatten(fields):
+    stats = {}
+    for path, value in fields.items():
+        *parents, key = path.split(".")
+        node = stats
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[key] = value
+    return stats
+
+
+def column(values):
+    """Smallest lossless-enough typed array for one field of every image"""
+    present = [value for value in values if value is not None]
+    if all(isinstance(value, bool) for value in present):
+        return np.array([bool(value) for value in values])
+    if all(isinstance(value, int) for value in present):
+        return np.array([value or 0 for value in values], dtype=np.int64)
+    if all(isinstance(value, (int, float)) for value in present):
+        return np.array(
+            [np.nan if value is None else value for value in values],
+            dtype=np.float32,
+        )
+    return np.array(["" if value is None else str(value) for value in values])
+
+
+def encode(insights, embeddings=None):
+    """Bytes of the .npz holding `insights` and the {filename: vector} embeddings"""
+    filenames = list(insights["images"])
+    rows = [flatten(insights["images"][name]) for name in filenames]
+    # Union of the fields, each inserted after its predecessor so images missing
+    # a section (e.g. deep_features) do not change the key order of the others
+    paths = []
+    for row in rows:
+        position = 0
+        for path in row:
+            if path in paths:
+                position = paths.index(path) + 1
+            else:
+                paths.insert(position, path)
+                position += 1
+
+    columns = {"filename": np.array(filenames, dtype=str)}
+    for path in paths:
+        values = [row.get(path) for row in rows]
+        columns[path] = column(values)
+        if any(path not in row for row in rows):
+            columns[path + PRESENT_SUFFIX] = np.array([path in row for row in rows])
+        if any(path in row and row[path] is None for row in rows):
+            columns[path + NULL_SUFFIX] = np.array([value is None for value in values])
+
+    # A single structured array avoids a .npy header and ZIP entry per field
+    stats = np.zeros(
+        len(filenames), dtype=[(name, values.dtype) for name, values in columns.items()]
+    )
+    for name, values in columns.items():
+        stats[name] = values
+    arrays = {"stats": stats}
+
+    vectors = [(embeddings or {}).get(name) for name in filenames]
+    if any(vector is not None for vector in vectors):
+        dim = next(len(vector) for vector in vectors if vector is not None)
+        matrix = np.zeros((len(filenames), dim), dtype=np.float16)
+        for idx, vector in enumerate(vectors):
+            if vector is not None:
+                matrix[idx] = vector
+        arrays["embeddings"] = matrix
+        arrays["embeddings" + PRESENT_SUFFIX] = np.array(
+            [vector is not None for vector in vectors]
+        )
+
+    # Everything that is not per image is small and kept as JSON, with a
+    # placeholder so the images go back to their place in the document
+    metadata = dict(insights, images=None)
+    arrays["metadata"] = np.array(json.dumps(metadata))
+
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode(data):
+    """Rebuild the cuda_insights.json document and the {filename: vector} map"""
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        arrays = {name: npz[name] for name in npz.files}
+
+    insights = json.loads(str(arrays["metadata"]))
+    stats = arrays["stats"]
+    filenames = stats["filename"].tolist()
+    matrix = arrays.get("embeddings")
+    has_vector = arrays.get("embeddings" + PRESENT_SUFFIX)
+    columns = {
+        name: stats[name] for name in stats.dtype.names if name != "filename"
+    }
+    masks = {
+        name[: -len(PRESENT_SUFFIX)]: columns.pop(name)
+        for name in list(columns)
+        if name.endswith(PRESENT_SUFFIX)
+    }
+    nulls = {
+        name[: -len(NULL_SUFFIX)]: columns.pop(name)
+        for name in list(columns)
+        if name.endswith(NULL_SUFFIX)
+    }
+
+    images = {}
+    embeddings = {}
+    for idx, filename in enumerate(filenames):
+        fields = {
+            path: None if path in nulls and nulls[path][idx] else values[idx].item()
+            for path, values in columns.items()
+            if path not in masks or masks[path][idx]
+        }
+        images[filename] = unflatten(fields)
+        if matrix is not None and has_vector[idx]:
+            embeddings[filename] = matrix[idx].astype(np.float32)
+
+    insights["images"] = images
+    return insights, embeddings
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: compact_insights.py <insights.npz> [<output.json>]")
+        sys.exit(1)
+
+    with open(sys.argv[1], "rb") as f:
+        insights, embeddings = decode(f.read())
+    print(f"{len(insights['images'])} images, {len(embeddings)} embeddings")
+
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "w") as f:
+            json.dump(insights, f, indent=2)
+        print(f"Insights saved to: {sys.argv[2]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+import sys
+import os
+import io
+import json
+import time
+import torch
+import torchvision.transforms as transforms
+import torchvision.models as models
+from PIL import Image
+
+# Configuration
+OUTPUT_DIR = "/data"
+CHECKPOINT = os.path.join(OUTPUT_DIR, "resnet18-f37072fd.pth")
+# Variants to export, "fp32" and "fp16" (the latter needs the GPU)
+VARIANTS = os.environ.get("EXPORT_VARIANTS", "fp32,fp16").split(",")
+# Images used to measure the embedding drift against the FP32 checkpoint
+SAMPLE_IMAGES = int(os.environ.get("SAMPLE_IMAGES", "16"))
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "8"))
+
+# Redirect stdout and stderr to log file
+log_file = open(os.path.join(OUTPUT_DIR, "export_log.txt"), "w")
+sys.stdout = log_file
+sys.stderr = log_file
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+print(f"PyTorch Version: {torch.__version__}")
+print(f"Using device: {device}\n")
+
+
+def feature_model_path(variant):
+    """Location of an exported feature extractor, as loaded by fisheye.py"""
+    return os.path.join(OUTPUT_DIR, f"resnet18-features-{variant}.pt")
+
+
+def synchronize():
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+
+def load_checkpoint_extractor():
+    """Build the FP32 feature extractor exactly as fisheye.py does"""
+    model = models.resnet18()
+    model.load_state_dict(torch.load(CHECKPOINT, map_location=device))
+    model = model.to(device).eval()
+    return torch.nn.Sequential(*list(model.children())[:-1]).eval()
+
+
+def sample_batch():
+    """Preprocessed images from the volume, or random inputs if there are none"""
+    preprocess = transforms.Compose(
+        [
+            transforms.Resize(256),
+            transforms.CenterCrop(224),
+            transforms.ToTensor(),
+            transforms.Normalize(
+                mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
+            ),
+        ]
+    )
+    names = sorted(
+        name
+        for name in os.listdir(OUTPUT_DIR)
+        if name.lower().endswith((".png", ".jpg", ".jpeg"))
+    )[:SAMPLE_IMAGES]
+    if not names:
+        print("No images on the volume, measuring drift on random inputs")
+        return torch.randn(SAMPLE_IMAGES, 3, 224, 224)
+
+    print(f"Measuring drift on {len(names)} images from {OUTPUT_DIR}")
+    tensors = []
+    for name in names:
+        with open(os.path.join(OUTPUT_DIR, name), "rb") as f:
+            img = Image.open(io.BytesIO(f.read())).convert("RGB")
+        tensors.append(preprocess(img))
+    return torch.stack(tensors)
+
+
+def embed(extractor, inputs, dtype=torch.float32):
+    """Feature vectors of `inputs`, computed BATCH_SIZE images at a time"""
+    outputs = []
+    with torch.no_grad():
+        for start in range(0, len(inputs), BATCH_SIZE):
+            batch = inputs[start : start + BATCH_SIZE].to(device, dtype)
+            outputs.append(extractor(batch).flatten(1).float().cpu())
+    return torch.cat(outputs)
+
+
+def timed_first_batch(load, inputs, dtype=torch.float32):
+    """Cold start: load the extractor and run the first batch through it"""
+    synchronize()
+    start = time.perf_counter()
+    extractor = load()
+    load_seconds = time.perf_counter() - start
+    embed(extractor, inputs[:BATCH_SIZE], dtype)
+    synchronize()
+    return extractor, load_seconds, time.perf_counter() - start
+
+
+def drift(reference, embeddings):
+    cosine = torch.nn.functional.cosine_similarity(reference, embeddings, dim=1)
+    return {
+        "max_abs_diff": float((reference - embeddings).abs().max()),
+        "mean_cosine_similarity": float(cosine.mean()),
+        "min_cosine_similarity": float(cosine.min()),
+    }
+
+
+def export(variant, example):
+    """Trace, freeze and save the feature extractor in the given precision"""
+    if variant == "fp16" and device.type != "cuda":
+        print("Skipping fp16: half precision convolutions need the GPU")
+        return None
+    if variant not in ("fp32", "fp16"):
+        print(f"Skipping unknown variant {variant}")
+        return None
+
+    dtype = torch.float16 if variant == "fp16" else torch.float32
+    model = load_checkpoint_extractor().to(dtype)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example.to(device, dtype))
+    traced = torch.jit.freeze(traced)
+
+    path = feature_model_path(variant)
+    traced.save(path)
+    print(f"Exported {variant} feature extractor to {path}")
+
+    return path, dtype
+
+
+def main():
+    inputs = sample_batch()
+
+    # FP32 checkpoint: the reference for both cold start and embeddings
+    baseline, load_seconds, cold_start = timed_first_batch(
+        load_checkpoint_extractor, inputs
+    )
+    reference = embed(baseline, inputs)
+    report = {
+        "device": str(device),
+        "sample_images": len(inputs),
+        "variants": {
+            "checkpoint": {
+                "path": CHECKPOINT,
+                "size_bytes": os.path.getsize(CHECKPOINT),
+                "load_seconds": load_seconds,
+                "cold_start_seconds": cold_start,
+            }
+        },
+    }
+
+    for variant in VARIANTS:
+        exported = export(variant, inputs[:1])
+        if exported is None:
+            continue
+        path, dtype = exported
+
+        extractor, load_seconds, cold_start = timed_first_batch(
+            lambda: torch.jit.load(path, map_location=device), inputs, dtype
+        )
+        report["variants"][variant] = {
+            "path": path,
+            "size_bytes": os.path.getsize(path),
+            "load_seconds": load_seconds,
+            "cold_start_seconds": cold_start,
+            "drift": drift(reference, embed(extractor, inputs, dtype)),
+        }
+
+    for variant, stats in report["variants"].items():
+        print(
+            f"{variant:>10}: cold start {stats['cold_start_seconds']:.2f}s, "
+            f"{stats['size_bytes'] / 1e6:.1f} MB"
+        )
+        if "drift" in stats:
+            print(
+                f"{'':>10}  min cosine similarity "
+                f"{stats['drift']['min_cosine_similarity']:.6f}"
+            )
+
+    report_path = os.path.join(OUTPUT_DIR, "export_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport saved to: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,307 +1,1777 @@
 #!/usr/bin/env python3
 import sys
-import urllib.request
 import json
-import zipfile
 import io
 import os
-import struct
 from collections import Counter
 import numpy as np
-import torch
-import torchvision.transforms as transforms
-import torchvision.models as models
 from PIL import Image
 import time
+import contextlib
+import resource
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import compact_insights
+import image_io
+from image_io import (
+    IMAGE_LIMIT,
+    FileWriter,
+    load_manifest,
+    mapped_images,
+    save_manifest,
+    spool_all_images,
+    stream_recent_images,
+    sync_images,
+)
+
+# "torch" runs the CUDA analyzer on the GPU node, "numpy" a torch-free CPU
+# analyzer for the MPU and FPGA nodes (torch is then never imported)
+ANALYZER_BACKEND = os.environ.get("ANALYZER_BACKEND", "torch")
+if ANALYZER_BACKEND == "torch":
+    import torch
 
 # Configuration
-API_BASE = "http://satellite-telemetry.dphi-tm/api/images"
+TELEMETRY_API = "http://satellite-telemetry.dphi-tm"
 OUTPUT_DIR = "/data"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# Redirect stdout and stderr to log file
-log_file = open("/data/log.txt", "w")
-sys.stdout = log_file
-sys.stderr = log_file
-
-# CUDA Configuration
-print("=" * 60)
-print("JETSON NANO CUDA IMAGE ANALYSIS")
-print("=" * 60)
-print(f"PyTorch Version: {torch.__version__}")
-print(f"CUDA Available: {torch.cuda.is_available()}")
-if torch.cuda.is_available():
-    print(f"CUDA Device: {torch.cuda.get_device_name(0)}")
-    print(f"CUDA Version: {torch.version.cuda}")
-    print(f"cuDNN Version: {torch.backends.cudnn.version()}")
-    print(
-        f"GPU Memory: {torch.cuda.get_device_properties(0).total_memory / 1e9:.2f} GB"
-    )
-print("=" * 60)
+# Number of images sent through the GPU stages at once (set through pod envs)
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "8"))
+# Threads decoding and preprocessing images ahead of the GPU stage
+DECODE_WORKERS = int(os.environ.get("DECODE_WORKERS", "2"))
+# Maximum number of decoded images waiting for the GPU, and of pending writes
+QUEUE_DEPTH = int(os.environ.get("QUEUE_DEPTH", "8"))
+# Flush written files to the storage every FSYNC_BATCH files, 0 leaves it to the OS
+FSYNC_BATCH = int(os.environ.get("FSYNC_BATCH", "0"))
+# Tile edge (pixels) of the edge/texture stage, 0 processes whole images
+TILE_SIZE = int(os.environ.get("TILE_SIZE", "512"))
+# Compare peak memory of the tiled and unfold-based texture stages
+MEMORY_REPORT = os.environ.get("MEMORY_REPORT", "0") == "1"
+# Also export the per-stage timings as a Chrome trace (OUTPUT_DIR/trace.json)
+PROFILE_TRACE = os.environ.get("PROFILE_TRACE", "0") == "1"
+# Results of already analyzed images are reused across runs, 0 disables it
+CACHE_DIR = os.path.join(OUTPUT_DIR, "cache")
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_MB", "256")) * 1024 * 1024
+CACHE_INVALIDATE = os.environ.get("CACHE_INVALIDATE", "0") == "1"
+# Bump whenever the analysis changes so stale cache entries are not reused
+ANALYZER_VERSION = "2"
+# Feature extractor to load: an export of export_model.py ("fp32", "fp16"),
+# "checkpoint" to rebuild ResNet18 from its weights, or "auto" for the fp32
+# export when it is on the volume and the checkpoint otherwise
+FEATURE_MODEL = os.environ.get("FEATURE_MODEL", "auto")
+# "recent" fetches the IMAGE_LIMIT latest images, "incremental" only fetches
+# the images missing from OUTPUT_DIR according to image_io.MANIFEST_PATH,
+# "archive" spools the ZIP of every image to image_io.SPOOL_PATH and maps it
+SYNC_MODE = os.environ.get("SYNC_MODE", "recent")
+# Restrict the pixel statistics to the fisheye lens circle, detected once per
+# frame size and cached in LENS_PATH
+LENS_MASK = os.environ.get("LENS_MASK", "1") == "1"
+LENS_PATH = os.path.join(OUTPUT_DIR, "lens_circles.json")
+# "equirectangular" or "perspective" writes a rectified view of every frame
+# to RECTIFY_DIR, unset disables it. Sampling grids are built once per frame
+# size and lens, and cached in REMAP_DIR.
+RECTIFY = os.environ.get("RECTIFY", "")
+RECTIFY_SIZE = os.environ.get("RECTIFY_SIZE", "1024x1024")
+# Horizontal field of view of the perspective view, in degrees
+RECTIFY_FOV = float(os.environ.get("RECTIFY_FOV", "90"))
+# Field of view covered by the lens circle (equidistant model), in degrees
+LENS_FOV = float(os.environ.get("LENS_FOV", "180"))
+RECTIFY_DIR = os.path.join(OUTPUT_DIR, "rectified")
+REMAP_DIR = os.path.join(OUTPUT_DIR, "remap")
+# Embeddings of every analyzed frame, used to flag near-duplicates (cosine
+# similarity at or above DUPLICATE_THRESHOLD) and rank frames for downlink
+INDEX_PATH = os.path.join(OUTPUT_DIR, "embedding_index.npz")
+DUPLICATE_THRESHOLD = float(os.environ.get("DUPLICATE_THRESHOLD", "0.97"))
+DOWNLINK_BUDGET_BYTES = int(float(os.environ.get("DOWNLINK_BUDGET_MB", "10")) * 1e6)
+# JSON list of the frames already downlinked, uplinked from the ground. They
+# are flagged in the index and left out of every later plan.
+DOWNLINKED_PATH = os.path.join(OUTPUT_DIR, "downlinked.json")
+# Attach the position, velocity and attitude at capture time (parsed from the
+# filenames) to every frame, interpolated from telemetry fetched
+# TELEMETRY_MARGIN seconds around the frames. Samples further apart than
+# TELEMETRY_MAX_GAP seconds are not interpolated across; unset, the gap is
+# 2.5 times the median sample spacing of each fetched series (about 330 s at
+# the nominal cadence of one sample every 132 s)
+TELEMETRY_JOIN = os.environ.get("TELEMETRY_JOIN", "1") == "1"
+TELEMETRY_MARGIN = float(os.environ.get("TELEMETRY_MARGIN", "300"))
+TELEMETRY_MAX_GAP = (
+    float(os.environ["TELEMETRY_MAX_GAP"])
+    if os.environ.get("TELEMETRY_MAX_GAP")
+    else None
+)
+# "json" writes cuda_insights.json, "npz" the columnar cuda_insights.npz with
+# float16 embeddings (see compact_insights.py), "both" writes the two
+INSIGHTS_FORMAT = os.environ.get("INSIGHTS_FORMAT", "json")
 
-# Set device
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"\nUsing device: {device}\n")
+if ANALYZER_BACKEND == "torch":
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+else:
+    device = None
 
 
-def fetch_image_list():
-    """Fetch list of available images"""
-    print("Fetching image list...")
-    req = urllib.request.Request(f"{API_BASE}/list")
-    with urllib.request.urlopen(req) as response:
-        data = response.read()
-        return json.loads(data)
+def print_banner():
+    if ANALYZER_BACKEND == "torch":
+        # CUDA Configuration
+        print("=" * 60)
+        print("JETSON NANO CUDA IMAGE ANALYSIS")
+        print("=" * 60)
+        print(f"PyTorch Version: {torch.__version__}")
+        print(f"CUDA Available: {torch.cuda.is_available()}")
+        if torch.cuda.is_available():
+            print(f"CUDA Device: {torch.cuda.get_device_name(0)}")
+            print(f"CUDA Version: {torch.version.cuda}")
+            print(f"cuDNN Version: {torch.backends.cudnn.version()}")
+            print(
+                "GPU Memory: "
+                f"{torch.cuda.get_device_properties(0).total_memory / 1e9:.2f} GB"
+            )
+        print("=" * 60)
+        print(f"\nUsing device: {device}\n")
+    else:
+        print("=" * 60)
+        print("NUMPY CPU IMAGE ANALYSIS")
+        print("=" * 60)
+        print(f"NumPy Version: {np.__version__}")
+        print("=" * 60)
 
 
-def fetch_specific_images(image_names):
-    """Fetch specific images as ZIP"""
-    print(f"Fetching {len(image_names)} images...")
-    payload = json.dumps({"images": image_names}).encode("utf-8")
-    req = urllib.request.Request(
-        API_BASE, data=payload, headers={"Content-Type": "application/json"}
-    )
-    with urllib.request.urlopen(req) as response:
-        return response.read()
+def feature_model_path(variant):
+    """Location of a feature extractor exported by export_model.py"""
+    return os.path.join(OUTPUT_DIR, f"resnet18-features-{variant}.pt")
 
 
-def fetch_recent_images(limit=10):
-    """Fetch recent images with limit"""
-    print(f"Fetching {limit} recent images...")
-    payload = json.dumps({"limit": limit}).encode("utf-8")
-    req = urllib.request.Request(
-        API_BASE, data=payload, headers={"Content-Type": "application/json"}
-    )
-    with urllib.request.urlopen(req) as response:
-        return response.read()
+class Profiler:
+    """Per-stage timings of the analysis, kept call by call
+
+    GPU stages are measured with CUDA events, so asynchronous kernels are
+    attributed to the stage that queued them; CPU stages use perf_counter.
+    Every call is kept so the run can be exported as a Chrome trace.
+    """
+
+    def __init__(self, cuda_used=False):
+        self.cuda_used = cuda_used
+        self.lock = threading.Lock()
+        self.cpu_calls = []
+        self.gpu_calls = []
+        self.origin = time.perf_counter()
+        if cuda_used:
+            torch.cuda.reset_peak_memory_stats()
+            self.origin_event = torch.cuda.Event(enable_timing=True)
+            self.origin_event.record()
+
+    @contextlib.contextmanager
+    def stage(self, name, gpu=False):
+        if gpu and self.cuda_used:
+            start = torch.cuda.Event(enable_timing=True)
+            end = torch.cuda.Event(enable_timing=True)
+            start.record()
+            yield
+            end.record()
+            with self.lock:
+                self.gpu_calls.append((name, start, end))
+        else:
+            start = time.perf_counter()
+            yield
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.cpu_calls.append(
+                    (
+                        name,
+                        threading.current_thread().name,
+                        start - self.origin,
+                        duration,
+                    )
+                )
+
+    def calls(self):
+        """(stage, track, start, duration) of every call, in seconds from the start"""
+        with self.lock:
+            calls = list(self.cpu_calls)
+            gpu_calls = list(self.gpu_calls)
+        if gpu_calls:
+            torch.cuda.synchronize()
+        for name, start, end in gpu_calls:
+            calls.append(
+                (
+                    name,
+                    "cuda",
+                    self.origin_event.elapsed_time(start) / 1000,
+                    start.elapsed_time(end) / 1000,
+                )
+            )
+        return sorted(calls, key=lambda call: call[2])
+
+    def report(self):
+        stages = {}
+        for name, track, _, duration in self.calls():
+            stage = stages.setdefault(
+                name,
+                {
+                    "device": "cuda" if track == "cuda" else "cpu",
+                    "calls": 0,
+                    "total_seconds": 0.0,
+                },
+            )
+            stage["calls"] += 1
+            stage["total_seconds"] += duration
+        for stage in stages.values():
+            stage["mean_ms"] = stage["total_seconds"] / stage["calls"] * 1000
+
+        # ru_maxrss is in kilobytes on Linux
+        memory = {
+            "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        }
+        if self.cuda_used:
+            memory["peak_allocated_bytes"] = torch.cuda.max_memory_allocated()
+            memory["peak_reserved_bytes"] = torch.cuda.max_memory_reserved()
+        return {"stages": stages, "memory": memory}
+
+    def save_chrome_trace(self, path):
+        """Write the calls in the Chrome trace format (chrome://tracing, Perfetto)"""
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "pid": ANALYZER_BACKEND,
+                "tid": track,
+                "ts": start * 1e6,
+                "dur": duration * 1e6,
+            }
+            for name, track, start, duration in self.calls()
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+class LensCalibration:
+    """Lens circle of each camera configuration, detected once and cached
+
+    Frames of the same size come from the same camera configuration. The first
+    frame of each size with a clearly lit disc is used to find the circle,
+    which is stored in the JSON file at `path` (LENS_PATH in the pipeline) so
+    later runs skip the detection. Delete that file after changing the camera
+    setup.
+    """
+
+    # Brightest channel value above which a pixel is lit rather than dead border
+    LIT_THRESHOLD = 20
+    # Frames with less dead border than this are analyzed whole
+    MIN_BORDER_FRACTION = 0.02
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.masks = {}
+        try:
+            with open(path) as f:
+                self.circles = json.load(f)
+        except (OSError, ValueError):
+            self.circles = {}
+
+    def lookup(self, pixels):
+        """Lens circle of an HxWx3 uint8 frame, None when there is no dead border"""
+        height, width = pixels.shape[:2]
+        key = f"{width}x{height}"
+        with self.lock:
+            if key in self.circles:
+                return self.circles[key]
+
+        circle, conclusive = self.detect(pixels, key)
+        if not conclusive:
+            # Too dark to tell the border from the disc, try the next frame
+            return None
+        with self.lock:
+            self.circles[key] = circle
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.circles, f, indent=2)
+            os.replace(self.path + ".tmp", self.path)
+        print(f"Lens circle of {key} frames: {circle}")
+        return circle
+
+    def detect(self, pixels, key):
+        """Fit the circle to the bounding box of the lit rows and columns
+
+        Returns (circle, conclusive). When the circle is cut by the frame on
+        one axis, it is assumed centered on that axis.
+        """
+        height, width = pixels.shape[:2]
+        lit = pixels.max(axis=2) > self.LIT_THRESHOLD
+        rows = np.flatnonzero(lit.mean(axis=1) > 0.01)
+        cols = np.flatnonzero(lit.mean(axis=0) > 0.01)
+        if not len(rows) or not len(cols):
+            return None, False
+
+        y0, y1 = int(rows[0]), int(rows[-1]) + 1
+        x0, x1 = int(cols[0]), int(cols[-1]) + 1
+        radius = max(y1 - y0, x1 - x0) / 2
+        circle = {
+            "key": key,
+            "center_x": (x0 + x1 - 1) / 2 if x1 - x0 < width else (width - 1) / 2,
+            "center_y": (y0 + y1 - 1) / 2 if y1 - y0 < height else (height - 1) / 2,
+            "radius": radius,
+            "bbox": [y0, y1, x0, x1],
+        }
+        valid, _ = self.disc(circle, (0, height, 0, width))
+        circle["valid_fraction"] = float(valid.mean())
+
+        # A mostly dark disc cannot be told apart from the border
+        if lit[valid].mean() < 0.5:
+            return None, False
+
+        # Lit pixels beyond the circle, a couple of pixels away from the
+        # blurred lens edge, mean the frame has no dead border
+        near, _ = self.disc(dict(circle, radius=radius + 2), (0, height, 0, width))
+        if near.all() or lit[~near].mean() > 0.01:
+            return None, True
+        if circle["valid_fraction"] > 1 - self.MIN_BORDER_FRACTION:
+            return None, True
+        return circle, True
+
+    @staticmethod
+    def disc(circle, bbox):
+        """(valid, inner) pixel masks of the lens over `bbox`
+
+        `inner` only keeps pixels whose whole 5x5 neighbourhood is on the lens,
+        so the Sobel and local variance windows never straddle the border.
+        """
+        y0, y1, x0, x1 = bbox
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        distance = np.hypot(xx - circle["center_x"], yy - circle["center_y"])
+        # A 5x5 window reaches 2 * sqrt(2) pixels further than its center
+        return (
+            distance <= circle["radius"] - 0.5,
+            distance <= circle["radius"] - 0.5 - 2 * np.sqrt(2),
+        )
+
+    def crop_masks(self, circle):
+        """(valid, inner) masks over the bounding box the frames are cropped to"""
+        with self.lock:
+            if circle["key"] not in self.masks:
+                self.masks[circle["key"]] = self.disc(circle, circle["bbox"])
+            return self.masks[circle["key"]]
+
+
+class Rectifier:
+    """Equirectangular or perspective views of fisheye frames through cached grids
 
+    The lens follows the equidistant model: a ray at angle theta from the
+    optical axis lands theta / (LENS_FOV / 2) * radius away from the circle
+    center. The sampling grid only depends on the frame size, the lens circle
+    and the output view, so it is built once, stored in REMAP_DIR, and every
+    frame is then a single batched bilinear lookup.
+    """
 
-def extract_images(zip_data):
-    """Extract images from ZIP data"""
-    images = []
-    with zipfile.ZipFile(io.BytesIO(zip_data)) as zf:
-        for filename in zf.namelist():
-            if filename.lower().endswith((".png", ".jpg", ".jpeg")):
-                with zf.open(filename) as img_file:
-                    img_data = img_file.read()
-                    images.append((filename, img_data))
-    return images
+    def __init__(
+        self,
+        projection=RECTIFY,
+        size=RECTIFY_SIZE,
+        fov=RECTIFY_FOV,
+        lens_fov=LENS_FOV,
+        directory=REMAP_DIR,
+        profiler=None,
+    ):
+        if projection not in ("equirectangular", "perspective"):
+            raise ValueError(f"Unknown RECTIFY projection: {projection}")
+        self.projection = projection
+        self.width, self.height = (int(v) for v in size.lower().split("x"))
+        self.fov = fov
+        self.lens_fov = lens_fov
+        self.directory = directory
+        self.profiler = profiler or Profiler()
+        self.grids = {}
+        self.device_grids = {}
+        self.gathers = {}
+        self.grid_costs = []
+        self.frames = 0
+        os.makedirs(directory, exist_ok=True)
+        os.makedirs(RECTIFY_DIR, exist_ok=True)
 
+    def signature(self):
+        """Output view settings, part of the result cache version"""
+        fov = f"-{self.fov:g}" if self.projection == "perspective" else ""
+        return (
+            f"{self.projection}{fov}-{self.width}x{self.height}-lens{self.lens_fov:g}"
+        )
+
+    def grid_key(self, height, width, lens):
+        """Name of the grid of HxW frames (cropped to the lens bounding box)"""
+        if lens is None:
+            return f"{self.signature()}-{width}x{height}-full"
+        return (
+            f"{self.signature()}-{width}x{height}-{lens['center_x']:g}-"
+            f"{lens['center_y']:g}-{lens['radius']:g}"
+        )
+
+    def grid(self, height, width, lens):
+        """HoxWox2 float32 (x, y) source pixel of every output pixel, NaN off the lens"""
+        key = self.grid_key(height, width, lens)
+        if key in self.grids:
+            return key, self.grids[key]
+
+        path = os.path.join(self.directory, key + ".npy")
+        start = time.perf_counter()
+        with self.profiler.stage("remap_grid"):
+            try:
+                grid = np.load(path)
+                source = "disk"
+            except (OSError, ValueError):
+                grid = self.build_grid(height, width, lens)
+                np.save(path + ".tmp.npy", grid)
+                os.replace(path + ".tmp.npy", path)
+                source = "built"
+        self.grid_costs.append(
+            {"key": key, "source": source, "seconds": time.perf_counter() - start}
+        )
+        print(f"Remap grid {key} {'loaded' if source == 'disk' else 'built'}")
+        self.grids[key] = grid
+        return key, grid
+
+    def build_grid(self, height, width, lens):
+        if lens is None:
+            # No dead border: the circle is assumed cut by the shorter side
+            center_x, center_y = (width - 1) / 2, (height - 1) / 2
+            radius = max(height, width) / 2
+        else:
+            y0, _, x0, _ = lens["bbox"]
+            center_x, center_y = lens["center_x"] - x0, lens["center_y"] - y0
+            radius = lens["radius"]
+
+        # Ray direction of every output pixel, z along the optical axis
+        u = (np.arange(self.width) + 0.5) / self.width
+        v = (np.arange(self.height) + 0.5) / self.height
+        half_lens = np.radians(self.lens_fov) / 2
+        if self.projection == "equirectangular":
+            lon = (u - 0.5) * 2 * half_lens
+            lat = (v - 0.5) * 2 * half_lens
+            lon, lat = np.meshgrid(lon, lat)
+            x = np.cos(lat) * np.sin(lon)
+            y = np.sin(lat)
+            z = np.cos(lat) * np.cos(lon)
+        else:
+            focal = 0.5 / np.tan(np.radians(self.fov) / 2)
+            x, y = np.meshgrid(
+                (u - 0.5) / focal, (v - 0.5) * self.height / self.width / focal
+            )
+            z = np.ones_like(x)
+
+        theta = np.arccos(np.clip(z / np.sqrt(x * x + y * y + z * z), -1, 1))
+        phi = np.arctan2(y, x)
+        r = theta / half_lens * radius
+        grid = np.stack(
+            [center_x + r * np.cos(phi), center_y + r * np.sin(phi)], axis=-1
+        ).astype(np.float32)
+        grid[theta > half_lens] = np.nan
+        return grid
+
+    def remap_torch(self, img_tensor_rgb, lens):
+        """Rectify an NxHxWx3 float batch on its device with one grid_sample call
+
+        Returns the NxHoxWox3 uint8 views on the host.
+        """
+        n, height, width, _ = img_tensor_rgb.shape
+        key, grid = self.grid(height, width, lens)
+        if key not in self.device_grids:
+            # grid_sample coordinates, -1 and 1 being the centers of the
+            # border pixels; off-lens pixels are sampled from the zero padding
+            normalized = np.nan_to_num(
+                grid / np.array([width - 1, height - 1], np.float32) * 2 - 1, nan=-2.0
+            )
+            self.device_grids[key] = torch.from_numpy(normalized).to(
+                img_tensor_rgb.device
+            )
+
+        with self.profiler.stage("remap", gpu=True):
+            views = torch.nn.functional.grid_sample(
+                img_tensor_rgb.permute(0, 3, 1, 2),
+                self.device_grids[key].expand(n, -1, -1, -1),
+                mode="bilinear",
+                padding_mode="zeros",
+                align_corners=True,
+            )
+            views = views.permute(0, 2, 3, 1).round_().clamp_(0, 255).to(torch.uint8)
+        self.frames += n
+        return views.cpu().numpy()
+
+    def remap_numpy(self, pixels, lens):
+        """Rectify an NxHxWx3 uint8 batch with four gathers and a weighted sum
+
+        Returns the NxHoxWox3 uint8 views.
+        """
+        n, height, width, _ = pixels.shape
+        key, grid = self.grid(height, width, lens)
+        if key not in self.gathers:
+            # Flat indices and bilinear weights of the four neighbours, zero
+            # for neighbours off the frame or off the lens, as grid_sample does
+            x, y = grid[..., 0].ravel(), grid[..., 1].ravel()
+            valid = np.isfinite(x)
+            x, y = np.where(valid, x, 0), np.where(valid, y, 0)
+            x0, y0 = np.floor(x), np.floor(y)
+            fx, fy = x - x0, y - y0
+            indices, weights = [], []
+            for dy, dx, weight in (
+                (0, 0, (1 - fx) * (1 - fy)),
+                (0, 1, fx * (1 - fy)),
+                (1, 0, (1 - fx) * fy),
+                (1, 1, fx * fy),
+            ):
+                xs, ys = x0 + dx, y0 + dy
+                inside = valid & (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+                xs = np.clip(xs, 0, width - 1).astype(np.int64)
+                ys = np.clip(ys, 0, height - 1).astype(np.int64)
+                indices.append(ys * width + xs)
+                weights.append(np.where(inside, weight, 0).astype(np.float32))
+            self.gathers[key] = (np.stack(indices), np.stack(weights)[:, :, None])
+
+        indices, weights = self.gathers[key]
+        with self.profiler.stage("remap"):
+            flat = pixels.reshape(n, height * width, 3)
+            views = np.zeros((n, len(indices[0]), 3), np.float32)
+            for index, weight in zip(indices, weights):
+                views += flat[:, index] * weight
+            views = np.rint(views, out=views).clip(0, 255).astype(np.uint8)
+        self.frames += n
+        return views.reshape(n, self.height, self.width, 3)
+
+    def report(self, profile):
+        """Grid build/load cost and per-frame remap cost of the run"""
+        remap_seconds = profile["stages"].get("remap", {}).get("total_seconds", 0.0)
+        return {
+            "projection": self.projection,
+            "width": self.width,
+            "height": self.height,
+            "fov_degrees": self.fov if self.projection == "perspective" else None,
+            "lens_fov_degrees": self.lens_fov,
+            "grids": self.grid_costs,
+            "grid_build_seconds": sum(
+                g["seconds"] for g in self.grid_costs if g["source"] == "built"
+            ),
+            "grid_load_seconds": sum(
+                g["seconds"] for g in self.grid_costs if g["source"] == "disk"
+            ),
+            "frames": self.frames,
+            "remap_seconds": remap_seconds,
+            "remap_ms_per_frame": remap_seconds / self.frames * 1000
+            if self.frames
+            else 0.0,
+        }
+
+
+def rectified_path(filename):
+    """Location of the rectified view of an image"""
+    return os.path.join(RECTIFY_DIR, os.path.splitext(filename)[0] + ".png")
+
+
+def encode_png(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+class HostBufferPool:
+    """Reusable uint8 frame buffers, page-locked when frames go to a CUDA device
+
+    Decoded frames are copied into a buffer of their size, uploaded, and the
+    buffer is released once the upload has completed. Pinned allocations are
+    slow, so after the first few frames of each size none are made at all.
+    """
+
+    def __init__(self, pin_memory=False):
+        self.pin_memory = pin_memory
+        self.lock = threading.Lock()
+        self.free = {}
+        self.allocated = 0
+        self.allocated_bytes = 0
+        self.reused = 0
+
+    def acquire(self, shape):
+        shape = tuple(shape)
+        with self.lock:
+            if self.free.get(shape):
+                self.reused += 1
+                return self.free[shape].pop()
+            self.allocated += 1
+            self.allocated_bytes += int(np.prod(shape))
+        return torch.empty(shape, dtype=torch.uint8, pin_memory=self.pin_memory)
+
+    def release(self, buffer):
+        with self.lock:
+            self.free.setdefault(tuple(buffer.shape), []).append(buffer)
+
+    def report(self):
+        return {
+            "pinned": self.pin_memory,
+            "allocated": self.allocated,
+            "allocated_bytes": self.allocated_bytes,
+            "reused": self.reused,
+        }
 
-class ImageAnalyzer:
+
+class BatchAnalyzer:
+    """Common driver of the analyzers: decode() then analyze_decoded() per batch"""
+
+    cuda_used = False
+
+    def analyze_batch(self, images, batch_size=BATCH_SIZE, with_embeddings=False):
+        """Analyze a list of images, running each GPU stage once per batch
+
+        With `with_embeddings`, (stats, feature_vector) pairs are returned.
+        """
+        results = []
+        for start in range(0, len(images), batch_size):
+            start_time = time.perf_counter()
+            chunk = images[start : start + batch_size]
+            decoded = [self.decode(img_data) for img_data in chunk]
+            all_stats, features = self.analyze_decoded(decoded, start_time)
+            if with_embeddings:
+                results.extend(zip(all_stats, features))
+            else:
+                results.extend(all_stats)
+        return results
+
+    def synchronize(self):
+        """Wait for queued device work, so stage timings are accurate"""
+
+    def add_performance(self, results, start_time):
+        # Processing time is shared evenly between the images of the batch,
+        # once the queued device work has actually finished
+        self.synchronize()
+        processing_time = (time.perf_counter() - start_time) / len(results)
+        for stats in results:
+            stats["performance"] = {
+                "processing_time_seconds": processing_time,
+                "pixels_per_second": stats["basic_info"]["total_pixels"]
+                / processing_time,
+                "cuda_used": self.cuda_used,
+            }
+
+
+class ImageAnalyzer(BatchAnalyzer):
     """CUDA-accelerated image analyzer with deep learning features"""
 
-    def __init__(self, device):
+    def __init__(self, device, lens_path=LENS_PATH):
         self.device = device
+        self.cuda_used = device.type == "cuda"
+        self.profiler = Profiler(self.cuda_used)
+        self.lenses = LensCalibration(lens_path) if LENS_MASK else None
+        self.lens_masks = {}
+        self.rectifier = Rectifier(profiler=self.profiler) if RECTIFY else None
+        load_start = time.perf_counter()
 
-        # Load pre-trained ResNet18 for feature extraction (lightweight for Jetson)
-        print("Loading ResNet18 model from local checkpoint...")
-        ckpt = "/data/resnet18-f37072fd.pth"
+        # Prefer the ready-to-run TorchScript written by export_model.py
+        variant = "fp32" if FEATURE_MODEL == "auto" else FEATURE_MODEL
+        artifact = feature_model_path(variant) if variant != "checkpoint" else None
+        if artifact and os.path.exists(artifact):
+            print(f"Loading exported feature extractor {artifact}...")
+            self.feature_extractor = torch.jit.load(artifact, map_location=device)
+            self.feature_extractor.eval()
+            self.model_variant = variant
+        else:
+            if artifact and FEATURE_MODEL != "auto":
+                print(f"{artifact} not found, falling back to the checkpoint")
 
-        self.feature_model = models.resnet18()
-        state = torch.load(ckpt, map_location=device)
-        self.feature_model.load_state_dict(state)
+            # torchvision is only needed, and only imported, to rebuild the model
+            import torchvision.models as models
 
-        self.feature_model = self.feature_model.to(device)
-        self.feature_model.eval()
+            # Load pre-trained ResNet18 for feature extraction (lightweight for Jetson)
+            print("Loading ResNet18 model from local checkpoint...")
+            ckpt = "/data/resnet18-f37072fd.pth"
 
-        # Remove final classification layer to get features
-        self.feature_extractor = torch.nn.Sequential(
-            *list(self.feature_model.children())[:-1]
+            self.feature_model = models.resnet18()
+            state = torch.load(ckpt, map_location=device)
+            self.feature_model.load_state_dict(state)
+
+            self.feature_model = self.feature_model.to(device)
+            self.feature_model.eval()
+
+            # Remove final classification layer to get features
+            self.feature_extractor = torch.nn.Sequential(
+                *list(self.feature_model.children())[:-1]
+            )
+            self.model_variant = "checkpoint"
+        self.model_dtype = (
+            torch.float16 if self.model_variant == "fp16" else torch.float32
         )
 
-        # Image preprocessing
-        self.preprocess = transforms.Compose(
+        # Frames are uploaded once as raw uint8 and preprocessed on the device
+        self.buffers = HostBufferPool(pin_memory=self.cuda_used)
+        self.mean = torch.tensor([0.485, 0.456, 0.406], device=device).view(3, 1, 1)
+        self.std = torch.tensor([0.229, 0.224, 0.225], device=device).view(3, 1, 1)
+
+        # Sobel kernels, stacked so one convolution yields both gradients
+        self.sobel = torch.tensor(
             [
-                transforms.Resize(256),
-                transforms.CenterCrop(224),
-                transforms.ToTensor(),
-                transforms.Normalize(
-                    mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
-                ),
-            ]
-        )
+                [[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]],
+                [[-1, -2, -1], [0, 0, 0], [1, 2, 1]],
+            ],
+            dtype=torch.float32,
+            device=device,
+        ).unsqueeze(1)
 
         # For classification (optional)
         with open("/tmp/imagenet_classes.txt", "w") as f:
             # Simplified - in practice you'd load actual ImageNet classes
             f.write("satellite\nearth\ncloud\nocean\nland\n")
 
-    def analyze_cuda(self, img_data):
-        """Perform GPU-accelerated image analysis"""
-        start_time = time.time()
+        self.load_seconds = time.perf_counter() - load_start
+
+    def decode(self, img_data):
+        """Decode an image into a reusable uint8 buffer, ready for upload
 
-        # Load image
-        img = Image.open(io.BytesIO(img_data)).convert("RGB")
-        img_np = np.array(img)
+        The buffer is page-locked on CUDA so the upload runs asynchronously.
+        Resizing, cropping and normalization all happen on the device.
+        """
+        with self.profiler.stage("decode"):
+            img = Image.open(io.BytesIO(img_data)).convert("RGB")
+        with self.profiler.stage("preprocess"):
+            pixels = np.asarray(img)
+            lens = self.lenses.lookup(pixels) if self.lenses else None
+            buffer = self.buffers.acquire(pixels.shape)
+            np.copyto(buffer.numpy(), pixels)
 
-        stats = {
+        return {
             "basic_info": {
                 "width": img.width,
                 "height": img.height,
                 "total_pixels": img.width * img.height,
                 "mode": img.mode,
                 "size_bytes": len(img_data),
-            }
+            },
+            "pixels": buffer,
+            "lens": lens,
         }
 
-        # Convert to tensor and move to GPU
-        img_tensor = self.preprocess(img).unsqueeze(0).to(self.device)
-
-        # Extract deep features using CUDA
-        with torch.no_grad():
-            features = self.feature_extractor(img_tensor)
-            feature_vector = features.squeeze().cpu().numpy()
-
-            stats["deep_features"] = {
-                "feature_dimension": len(feature_vector),
-                "feature_mean": float(np.mean(feature_vector)),
-                "feature_std": float(np.std(feature_vector)),
-                "feature_l2_norm": float(np.linalg.norm(feature_vector)),
-                "feature_sparsity": float(
-                    np.sum(feature_vector == 0) / len(feature_vector)
-                ),
-            }
+    def analyze_cuda(self, img_data):
+        """Perform GPU-accelerated image analysis"""
+        return self.analyze_batch([img_data], batch_size=1)[0]
+
+    def synchronize(self):
+        if self.device.type == "cuda":
+            torch.cuda.synchronize()
+
+    def analyze_decoded(self, decoded, start_time):
+        """Run the feature extractor and pixel statistics on decoded images
+
+        Returns the stats of each image and the NxD array of feature vectors.
+        """
+        results = [{"basic_info": item["basic_info"]} for item in decoded]
+
+        # Single upload of the raw bytes of every frame
+        with self.profiler.stage("h2d_copy", gpu=True):
+            frames = [
+                item["pixels"].to(self.device, non_blocking=True) for item in decoded
+            ]
+        with self.profiler.stage("device_preprocess", gpu=True):
+            batch = torch.stack([self.model_input(frame) for frame in frames]).to(
+                self.model_dtype
+            )
+
+        # Extract deep features for the whole batch using CUDA
+        with self.profiler.stage("feature_extraction", gpu=True), torch.no_grad():
+            features = self.feature_extractor(batch).flatten(1).float().cpu().numpy()
+
+        for stats, feature_vector in zip(results, features):
+            stats["deep_features"] = feature_stats(feature_vector)
+
+        # Full-resolution stages need equally sized images from the same
+        # camera configuration to be stacked
+        groups = {}
+        for idx, item in enumerate(decoded):
+            lens = item["lens"]
+            key = (tuple(item["pixels"].shape), lens["key"] if lens else None)
+            groups.setdefault(key, []).append(idx)
+
+        for indices in groups.values():
+            lens = decoded[indices[0]]["lens"]
+            # Only the bounding box of the lens circle is analyzed
+            y0, y1, x0, x1 = lens["bbox"] if lens is not None else (0, None, 0, None)
+            with self.profiler.stage("device_preprocess", gpu=True):
+                img_tensor_rgb = torch.stack(
+                    [frames[idx][y0:y1, x0:x1] for idx in indices]
+                ).float()
+            all_stats = self.pixel_stats(img_tensor_rgb, lens)
+            for idx, pixel_stats in zip(indices, all_stats):
+                results[idx].update(pixel_stats)
+                if lens is not None:
+                    results[idx]["lens"] = lens_info(lens)
+            if self.rectifier is not None:
+                views = self.rectifier.remap_torch(img_tensor_rgb, lens)
+                for idx, view in zip(indices, views):
+                    decoded[idx]["rectified"] = view
 
-        # Color analysis on GPU
-        img_tensor_rgb = torch.from_numpy(img_np).float().to(self.device)
+        # The uploads are complete once add_performance has synchronized
+        self.add_performance(results, start_time)
+        for item in decoded:
+            self.buffers.release(item.pop("pixels"))
+        return results, features
+
+    def model_input(self, frame):
+        """Resize(256), CenterCrop(224) and Normalize of an HxWx3 uint8 frame
+
+        Same steps as the torchvision transforms on a PIL image, run on the
+        device; the antialiased resize matches PIL's bilinear filter closely.
+        """
+        height, width, _ = frame.shape
+        if height <= width:
+            size = (256, int(256 * width / height))
+        else:
+            size = (int(256 * height / width), 256)
+        image = torch.nn.functional.interpolate(
+            frame.permute(2, 0, 1).unsqueeze(0).float(),
+            size=size,
+            mode="bilinear",
+            align_corners=False,
+            antialias=True,
+        )[0]
+        top = int(round((size[0] - 224) / 2.0))
+        left = int(round((size[1] - 224) / 2.0))
+        image = image[:, top : top + 224, left : left + 224]
+        return (image / 255.0 - self.mean) / self.std
+
+    def device_lens_masks(self, lens):
+        """Flat indices of the lens pixels and the float inner mask, on the device"""
+        if lens["key"] not in self.lens_masks:
+            valid, inner = self.lenses.crop_masks(lens)
+            self.lens_masks[lens["key"]] = (
+                torch.from_numpy(np.flatnonzero(valid)).to(self.device),
+                torch.from_numpy(inner).to(self.device, torch.float32),
+            )
+        return self.lens_masks[lens["key"]]
+
+    def pixel_stats(self, img_tensor_rgb, lens=None):
+        """Color, edge, texture and histogram analysis of an NxHxWx3 batch
+
+        With a lens circle, only the pixels on the lens are taken into account.
+        """
+        n = img_tensor_rgb.shape[0]
+        valid_idx, inner = (
+            self.device_lens_masks(lens) if lens is not None else (None, None)
+        )
 
         # Channel statistics
-        r_channel = img_tensor_rgb[:, :, 0]
-        g_channel = img_tensor_rgb[:, :, 1]
-        b_channel = img_tensor_rgb[:, :, 2]
-
-        stats["color_analysis"] = {
-            "red_channel": {
-                "mean": float(r_channel.mean()),
-                "std": float(r_channel.std()),
-                "min": float(r_channel.min()),
-                "max": float(r_channel.max()),
-            },
-            "green_channel": {
-                "mean": float(g_channel.mean()),
-                "std": float(g_channel.std()),
-                "min": float(g_channel.min()),
-                "max": float(g_channel.max()),
-            },
-            "blue_channel": {
-                "mean": float(b_channel.mean()),
-                "std": float(b_channel.std()),
-                "min": float(b_channel.min()),
-                "max": float(b_channel.max()),
-            },
-            "overall_brightness": float(img_tensor_rgb.mean()),
-            "overall_contrast": float(img_tensor_rgb.std()),
+        with self.profiler.stage("color", gpu=True):
+            channels = img_tensor_rgb.permute(0, 3, 1, 2).reshape(n, 3, -1)
+            if valid_idx is not None:
+                channels = channels.index_select(2, valid_idx)
+            channel_mean = channels.mean(dim=2).tolist()
+            channel_std = channels.std(dim=2).tolist()
+            channel_min = channels.amin(dim=2).tolist()
+            channel_max = channels.amax(dim=2).tolist()
+            flat = channels.reshape(n, -1)
+            brightness = flat.mean(dim=1).tolist()
+            contrast = flat.std(dim=1).tolist()
+
+        # Edge detection (Sobel operator) and texture analysis (local variance)
+        gray_4d = img_tensor_rgb.mean(dim=3).unsqueeze(1)
+        edge_texture = self.edge_texture_stats(gray_4d, mask=inner)
+
+        # Histogram analysis on GPU: one histc call covers every image and
+        # channel by shifting each row into its own range of bins
+        with self.profiler.stage("histogram", gpu=True):
+            hist_bins = 32
+            rows = channels.reshape(n * 3, -1)
+            bin_idx = torch.floor(rows * (hist_bins / 255.0)).clamp_(
+                max=hist_bins - 1
+            )
+            offsets = torch.arange(n * 3, device=self.device, dtype=torch.float32)
+            bin_idx += offsets.unsqueeze(1) * hist_bins
+            hist = torch.histc(
+                bin_idx + 0.5, bins=hist_bins * n * 3, min=0, max=hist_bins * n * 3
+            ).view(n, 3, hist_bins)
+            entropy = (-torch.sum(hist * torch.log2(hist + 1e-10), dim=2)).tolist()
+
+        return [
+            format_pixel_stats(
+                channel_mean[i],
+                channel_std[i],
+                channel_min[i],
+                channel_max[i],
+                brightness[i],
+                contrast[i],
+                {key: values[i] for key, values in edge_texture.items()},
+                entropy[i],
+            )
+            for i in range(n)
+        ]
+
+    def edge_texture_stats(self, gray_4d, tile_size=TILE_SIZE, mask=None):
+        """Sobel magnitude and 5x5 local variance statistics of an Nx1xHxW batch
+
+        The image is processed in tiles with a two pixel halo, so results match
+        whole-image processing while temporary buffers only cover one tile.
+        Only pixels where the HxW float `mask` is 1 are counted.
+        """
+        n, _, height, width = gray_4d.shape
+        tile_size = tile_size or max(height, width)
+        total = height * width if mask is None else int(mask.sum())
+
+        # Zero padding as in the whole-image convolutions. Both filters are
+        # shift invariant, so recentering keeps the squared terms small.
+        padded = torch.nn.functional.pad(gray_4d, (2, 2, 2, 2)) - 128.0
+
+        acc = {
+            key: torch.zeros(n, dtype=torch.float64, device=self.device)
+            for key in ("edge_sum", "edge_sq", "var_sum", "var_sq")
         }
+        edge_max = torch.zeros(n, device=self.device)
 
-        # Edge detection (Sobel operator on GPU)
-        gray = img_tensor_rgb.mean(dim=2)
+        for y0 in range(0, height, tile_size):
+            y1 = min(y0 + tile_size, height)
+            for x0 in range(0, width, tile_size):
+                x1 = min(x0 + tile_size, width)
+                tile = padded[:, :, y0 : y1 + 4, x0 : x1 + 4]
+                weights = None if mask is None else mask[y0:y1, x0:x1].reshape(1, -1)
 
-        # Sobel kernels
-        sobel_x = (
-            torch.tensor(
-                [[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]],
-                dtype=torch.float32,
-                device=self.device,
+                with self.profiler.stage("edge", gpu=True):
+                    gradients = torch.nn.functional.conv2d(
+                        tile[:, :, 1:-1, 1:-1], self.sobel
+                    )
+                    magnitude = gradients.square_().sum(dim=1).sqrt_().flatten(1)
+                    if weights is not None:
+                        # Non-negative, so masked out pixels never win the max
+                        magnitude.mul_(weights)
+                    acc["edge_sum"] += magnitude.sum(dim=1, dtype=torch.float64)
+                    acc["edge_sq"] += magnitude.square().sum(
+                        dim=1, dtype=torch.float64
+                    )
+                    edge_max = torch.maximum(edge_max, magnitude.amax(dim=1))
+
+                # Unbiased variance of each 5x5 window from box-filtered moments
+                with self.profiler.stage("texture", gpu=True):
+                    local_mean = torch.nn.functional.avg_pool2d(tile, 5, stride=1)
+                    local_sq = torch.nn.functional.avg_pool2d(
+                        tile * tile, 5, stride=1
+                    )
+                    local_variance = (
+                        (local_sq - local_mean.square_()).clamp_(min=0) * (25 / 24)
+                    ).flatten(1)
+                    if weights is not None:
+                        local_variance.mul_(weights)
+                    acc["var_sum"] += local_variance.sum(dim=1, dtype=torch.float64)
+                    acc["var_sq"] += local_variance.square().sum(
+                        dim=1, dtype=torch.float64
+                    )
+
+        def mean_std(prefix):
+            mean = acc[f"{prefix}_sum"] / total
+            var = (acc[f"{prefix}_sq"] - acc[f"{prefix}_sum"] * mean) / max(
+                total - 1, 1
             )
-            .unsqueeze(0)
-            .unsqueeze(0)
+            return mean.tolist(), var.clamp(min=0).sqrt().tolist()
+
+        edge_mean, edge_std = mean_std("edge")
+        variance_mean, variance_std = mean_std("var")
+        return {
+            "edge_mean": edge_mean,
+            "edge_std": edge_std,
+            "edge_max": edge_max.tolist(),
+            "variance_mean": variance_mean,
+            "variance_std": variance_std,
+        }
+
+    def edge_texture_stats_unfold(self, gray_4d):
+        """Reference whole-image implementation, kept for memory comparisons"""
+        edges = torch.nn.functional.conv2d(gray_4d, self.sobel, padding=1)
+        edges_magnitude = torch.sqrt(edges[:, :1] ** 2 + edges[:, 1:] ** 2).flatten(1)
+
+        unfold = torch.nn.Unfold(kernel_size=5, padding=2)
+        local_variance = unfold(gray_4d).var(dim=1)
+
+        return {
+            "edge_mean": edges_magnitude.mean(dim=1).tolist(),
+            "edge_std": edges_magnitude.std(dim=1).tolist(),
+            "edge_max": edges_magnitude.amax(dim=1).tolist(),
+            "variance_mean": local_variance.mean(dim=1).tolist(),
+            "variance_std": local_variance.std(dim=1).tolist(),
+        }
+
+
+def edge_texture_memory_report(analyzer, height, width, tile_size=TILE_SIZE):
+    """Compare peak GPU memory of the unfold-based and tiled edge/texture stages"""
+    if not analyzer.cuda_used:
+        return None
+
+    gray_4d = torch.randint(
+        0, 256, (1, 1, height, width), dtype=torch.float32, device=analyzer.device
+    )
+    report = {"height": height, "width": width, "tile_size": tile_size}
+    implementations = {
+        "unfold": analyzer.edge_texture_stats_unfold,
+        "tiled": lambda x: analyzer.edge_texture_stats(x, tile_size=tile_size),
+    }
+    for name, implementation in implementations.items():
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.memory_allocated()
+        try:
+            stats = implementation(gray_4d)
+        except torch.cuda.OutOfMemoryError:
+            stats = "out of memory"
+        torch.cuda.synchronize()
+        report[name] = {
+            "peak_bytes": torch.cuda.max_memory_allocated() - baseline,
+            "stats": stats,
+        }
+        torch.cuda.empty_cache()
+
+    return report
+
+
+class NumpyImageAnalyzer(BatchAnalyzer):
+    """Torch-free CPU analyzer producing the same pixel statistics
+
+    Intended for the MPU and FPGA nodes: it only needs NumPy and Pillow, and
+    skips the ResNet deep features.
+    """
+
+    # Lookup table from 8-bit value to one of the 32 histogram bins, matching
+    # torch.histc(bins=32, min=0, max=255)
+    HIST_LUT = np.minimum(np.arange(256) * 32 // 255, 31)
+
+    def __init__(self, tile_size=TILE_SIZE, lens_path=LENS_PATH):
+        self.tile_size = tile_size
+        self.profiler = Profiler()
+        self.lenses = LensCalibration(lens_path) if LENS_MASK else None
+        self.rectifier = Rectifier(profiler=self.profiler) if RECTIFY else None
+
+    def decode(self, img_data):
+        """Decode an image into an HxWx3 uint8 array"""
+        with self.profiler.stage("decode"):
+            img = Image.open(io.BytesIO(img_data)).convert("RGB")
+        with self.profiler.stage("preprocess"):
+            pixels = np.asarray(img)
+            lens = self.lenses.lookup(pixels) if self.lenses else None
+            if lens is not None:
+                y0, y1, x0, x1 = lens["bbox"]
+                pixels = pixels[y0:y1, x0:x1]
+        return {
+            "basic_info": {
+                "width": img.width,
+                "height": img.height,
+                "total_pixels": img.width * img.height,
+                "mode": img.mode,
+                "size_bytes": len(img_data),
+            },
+            "pixels": pixels,
+            "lens": lens,
+        }
+
+    def analyze_decoded(self, decoded, start_time):
+        """Pixel statistics of decoded images (no feature vectors)"""
+        results = []
+        for item in decoded:
+            stats = {"basic_info": item["basic_info"]}
+            stats.update(self.pixel_stats(item["pixels"], item["lens"]))
+            if item["lens"] is not None:
+                stats["lens"] = lens_info(item["lens"])
+            results.append(stats)
+
+        if self.rectifier is not None:
+            # Frames sharing a grid are gathered together
+            groups = {}
+            for item in decoded:
+                lens = item["lens"]
+                key = (item["pixels"].shape, lens["key"] if lens else None)
+                groups.setdefault(key, []).append(item)
+            for items in groups.values():
+                views = self.rectifier.remap_numpy(
+                    np.stack([item["pixels"] for item in items]), items[0]["lens"]
+                )
+                for item, view in zip(items, views):
+                    item["rectified"] = view
+
+        self.add_performance(results, start_time)
+        return results, [None] * len(results)
+
+    def pixel_stats(self, pixels, lens=None):
+        """Color, edge, texture and histogram analysis of an HxWx3 uint8 image
+
+        With a lens circle, only the pixels on the lens are taken into account.
+        """
+        valid, inner = (
+            self.lenses.crop_masks(lens) if lens is not None else (None, None)
         )
-        sobel_y = (
-            torch.tensor(
-                [[-1, -2, -1], [0, 0, 0], [1, 2, 1]],
-                dtype=torch.float32,
-                device=self.device,
+
+        # Per-channel 256-value histograms give every color statistic and the
+        # 32-bin histograms without another pass over the pixels
+        with self.profiler.stage("color"):
+            values = pixels[valid] if valid is not None else pixels.reshape(-1, 3)
+            counts = np.stack(
+                [np.bincount(values[:, c], minlength=256) for c in range(3)]
+            ).astype(np.float64)
+            values = np.arange(256, dtype=np.float64)
+
+            def moments(hist):
+                count = hist.sum()
+                mean = hist @ values / count
+                return mean, np.sqrt(hist @ (values - mean) ** 2 / max(count - 1, 1))
+
+            channel_mean, channel_std = zip(*(moments(row) for row in counts))
+            brightness, contrast = moments(counts.sum(axis=0))
+            occupied = counts > 0
+            channel_min = [float(np.argmax(row)) for row in occupied]
+            channel_max = [float(255 - np.argmax(row[::-1])) for row in occupied]
+
+        with self.profiler.stage("histogram"):
+            hist = np.stack(
+                [
+                    np.bincount(self.HIST_LUT, weights=row, minlength=32)
+                    for row in counts
+                ]
             )
-            .unsqueeze(0)
-            .unsqueeze(0)
+            entropy = -np.sum(hist * np.log2(hist + 1e-10), axis=1)
+
+        gray = pixels.astype(np.float32).mean(axis=2)
+        edge_texture = self.edge_texture_stats(gray, inner)
+
+        return format_pixel_stats(
+            [float(v) for v in channel_mean],
+            [float(v) for v in channel_std],
+            channel_min,
+            channel_max,
+            float(brightness),
+            float(contrast),
+            edge_texture,
+            entropy.tolist(),
         )
 
-        gray_4d = gray.unsqueeze(0).unsqueeze(0)
+    def edge_texture_stats(self, gray, mask=None):
+        """Sobel magnitude and 5x5 local variance statistics, in row strips
 
-        # Apply convolution for edge detection
-        edges_x = torch.nn.functional.conv2d(gray_4d, sobel_x, padding=1)
-        edges_y = torch.nn.functional.conv2d(gray_4d, sobel_y, padding=1)
-        edges_magnitude = torch.sqrt(edges_x**2 + edges_y**2)
+        Strips overlap by a two row halo so results match whole-image
+        processing with zero padding, as in the torch analyzer. Only pixels
+        where the HxW boolean `mask` is set are counted.
+        """
+        height, width = gray.shape
+        strip = self.tile_size or height
+        total = height * width if mask is None else int(mask.sum())
+        padded = np.pad(gray - 128.0, 2, constant_values=-128.0)
 
-        stats["edge_analysis"] = {
-            "edge_density": float(edges_magnitude.mean()),
-            "edge_strength_std": float(edges_magnitude.std()),
-            "max_edge_strength": float(edges_magnitude.max()),
-            "complexity_score": float(
-                edges_magnitude.std() / (edges_magnitude.mean() + 1e-6)
-            ),
-        }
+        edge_sum = edge_sq = var_sum = var_sq = 0.0
+        edge_max = 0.0
+        for y0 in range(0, height, strip):
+            y1 = min(y0 + strip, height)
+            block = padded[y0 : y1 + 4]
+            weights = None if mask is None else mask[y0:y1]
+
+            # Separable Sobel: [1, 2, 1] smoothing and [-1, 0, 1] derivative
+            with self.profiler.stage("edge"):
+                inner = block[1:-1, 1:-1]
+                smooth = inner[:-2] + 2 * inner[1:-1] + inner[2:]
+                gx = smooth[:, 2:] - smooth[:, :-2]
+                diff = inner[2:] - inner[:-2]
+                gy = diff[:, :-2] + 2 * diff[:, 1:-1] + diff[:, 2:]
+                magnitude = np.sqrt(gx * gx + gy * gy, dtype=np.float64)
+                if weights is not None:
+                    # Non-negative, so masked out pixels never win the max
+                    magnitude *= weights
+                edge_sum += magnitude.sum()
+                edge_sq += np.square(magnitude).sum()
+                edge_max = max(edge_max, float(magnitude.max()))
 
-        # Texture analysis (local variance)
-        kernel_size = 5
-        unfold = torch.nn.Unfold(kernel_size=kernel_size, padding=kernel_size // 2)
-        patches = unfold(gray_4d)
-        local_variance = patches.var(dim=1)
+            # Unbiased variance of each 5x5 window from box-filtered moments
+            with self.profiler.stage("texture"):
+                block = block.astype(np.float64)
+                box_sum = box_filter_5x5(block)
+                box_sq = box_filter_5x5(block * block)
+                local_variance = np.maximum(box_sq - box_sum * box_sum / 25, 0) / 24
+                if weights is not None:
+                    local_variance *= weights
+                var_sum += local_variance.sum()
+                var_sq += np.square(local_variance).sum()
 
-        stats["texture_analysis"] = {
-            "mean_local_variance": float(local_variance.mean()),
-            "texture_uniformity": float(1.0 / (local_variance.std() + 1e-6)),
-            "roughness_score": float(local_variance.std()),
+        edge_mean = edge_sum / total
+        variance_mean = var_sum / total
+        return {
+            "edge_mean": float(edge_mean),
+            "edge_std": sqrt_unbiased(edge_sq - edge_sum * edge_mean, total),
+            "edge_max": edge_max,
+            "variance_mean": float(variance_mean),
+            "variance_std": sqrt_unbiased(var_sq - var_sum * variance_mean, total),
         }
 
-        # Histogram analysis on GPU
-        hist_bins = 32
-        r_hist = torch.histc(r_channel, bins=hist_bins, min=0, max=255)
-        g_hist = torch.histc(g_channel, bins=hist_bins, min=0, max=255)
-        b_hist = torch.histc(b_channel, bins=hist_bins, min=0, max=255)
 
-        stats["histogram_analysis"] = {
-            "red_entropy": float(-torch.sum(r_hist * torch.log2(r_hist + 1e-10))),
-            "green_entropy": float(-torch.sum(g_hist * torch.log2(g_hist + 1e-10))),
-            "blue_entropy": float(-torch.sum(b_hist * torch.log2(b_hist + 1e-10))),
+def lens_info(lens):
+    """Lens circle as reported with the stats of each image"""
+    return {
+        "center_x": lens["center_x"],
+        "center_y": lens["center_y"],
+        "radius": lens["radius"],
+        "valid_fraction": lens["valid_fraction"],
+    }
+
+
+def box_filter_5x5(block):
+    """Sum of every 5x5 window of a 2D array (valid region only)"""
+    rows = np.cumsum(block, axis=0)
+    rows = np.concatenate([rows[4:5], rows[5:] - rows[:-5]])
+    cols = np.cumsum(rows, axis=1)
+    return np.concatenate([cols[:, 4:5], cols[:, 5:] - cols[:, :-5]], axis=1)
+
+
+def sqrt_unbiased(centered_sum_sq, count):
+    return float(np.sqrt(max(centered_sum_sq, 0.0) / max(count - 1, 1)))
+
+
+def format_pixel_stats(
+    channel_mean,
+    channel_std,
+    channel_min,
+    channel_max,
+    brightness,
+    contrast,
+    edge_texture,
+    entropy,
+):
+    """Lay out the pixel statistics of one image as in cuda_insights.json"""
+    color_analysis = {
+        f"{name}_channel": {
+            "mean": channel_mean[c],
+            "std": channel_std[c],
+            "min": channel_min[c],
+            "max": channel_max[c],
         }
+        for c, name in enumerate(("red", "green", "blue"))
+    }
+    color_analysis["overall_brightness"] = brightness
+    color_analysis["overall_contrast"] = contrast
+
+    edge_mean = edge_texture["edge_mean"]
+    edge_std = edge_texture["edge_std"]
+    variance_std = edge_texture["variance_std"]
+    return {
+        "color_analysis": color_analysis,
+        "edge_analysis": {
+            "edge_density": edge_mean,
+            "edge_strength_std": edge_std,
+            "max_edge_strength": edge_texture["edge_max"],
+            "complexity_score": edge_std / (edge_mean + 1e-6),
+        },
+        "texture_analysis": {
+            "mean_local_variance": edge_texture["variance_mean"],
+            "texture_uniformity": 1.0 / (variance_std + 1e-6),
+            "roughness_score": variance_std,
+        },
+        "histogram_analysis": {
+            "red_entropy": entropy[0],
+            "green_entropy": entropy[1],
+            "blue_entropy": entropy[2],
+        },
+    }
+
+
+def feature_stats(feature_vector):
+    """Summarize a ResNet feature vector"""
+    return {
+        "feature_dimension": len(feature_vector),
+        "feature_mean": float(np.mean(feature_vector)),
+        "feature_std": float(np.std(feature_vector)),
+        "feature_l2_norm": float(np.linalg.norm(feature_vector)),
+        "feature_sparsity": float(np.sum(feature_vector == 0) / len(feature_vector)),
+    }
+
+
+def npy_bytes(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+class ResultCache(image_io.ResultCache):
+    """image_io.ResultCache of the analysis stats and feature vectors
+
+    For analyzers producing feature vectors, each entry also has a
+    `<key>.npy` embedding next to its `<key>.json` stats.
+    """
+
+    def __init__(
+        self, directory, version=ANALYZER_VERSION, max_bytes=CACHE_MAX_BYTES
+    ):
+        super().__init__(directory, version, max_bytes)
+
+    def load(self, path):
+        """Return (stats, embedding) of the entry stored under `path`"""
+        stats = super().load(path)
+        embedding = np.load(path + ".npy") if stats.get("deep_features") else None
+        stats["performance"]["cached"] = True
+        return stats, embedding
+
+    def put(self, img_data, stats, embedding, writer=None):
+        """Store an entry, through `writer` (a FileWriter) when given
+
+        The stats are serialized right away, since the caller keeps adding
+        sections to them, while the files are written by the writer thread.
+        The embedding goes first, so a visible .json always has its .npy.
+        """
+        files = []
+        if embedding is not None:
+            files.append((".npy", lambda: npy_bytes(embedding)))
+        files.append((".json", json.dumps(stats).encode("utf-8")))
+        self.store(img_data, files, writer)
+
+
+class EmbeddingIndex:
+    """Unit-norm feature vectors of every analyzed frame, persisted on the volume
+
+    Queries are a single matrix product against the whole archive, and the
+    vectors live in a buffer that doubles when full so inserts stay amortized
+    constant time as the archive grows into the thousands. The size, novelty
+    score and downlinked flag of every frame are kept along, so frames can be
+    planned for downlink in any later run until they have been downlinked.
+    """
+
+    def __init__(self, path, threshold=DUPLICATE_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.names = []
+        self.positions = {}
+        self.sizes = []
+        self.novelty = []
+        self.downlinked = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as index:
+                self.names = index["names"].tolist()
+                self.sizes = index["sizes"].tolist()
+                self.novelty = index["novelty"].tolist()
+                self.vectors = index["vectors"].astype(np.float32)
+                self.downlinked = (
+                    index["downlinked"].tolist()
+                    if "downlinked" in index.files
+                    else [False] * len(self.names)
+                )
+            self.positions = {name: idx for idx, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def add(self, names, sizes, embeddings):
+        """Index a batch of frames, returning the novelty report of each one
+
+        Every frame is compared with the archive and with the frames before it
+        in the batch, so runs of near-identical consecutive frames are caught.
+        """
+        queries = np.asarray(embeddings, dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        count = len(self.names)
+        similarity = np.full((len(queries), count + len(queries)), -np.inf)
+        if count:
+            similarity[:, :count] = queries @ self.vectors[:count].T
+        within = queries @ queries.T
+        within[np.triu_indices(len(queries))] = -np.inf
+        similarity[:, count:] = within
+        nearest = similarity.argmax(axis=1)
+
+        self._reserve(count + len(queries), queries.shape[1])
+        self.vectors[count : count + len(queries)] = queries
+        reports = []
+        for name, size, row, idx in zip(names, sizes, similarity, nearest):
+            best = float(row[idx]) if np.isfinite(row[idx]) else None
+            novelty = 1.0 if best is None else 1.0 - best
+            self.positions[name] = len(self.names)
+            self.names.append(name)
+            self.sizes.append(size)
+            self.novelty.append(novelty)
+            self.downlinked.append(False)
+            reports.append(
+                {
+                    "nearest_image": None if best is None else self.names[idx],
+                    "similarity": best,
+                    "novelty_score": novelty,
+                    "near_duplicate": self.near_duplicate(novelty),
+                }
+            )
+        return reports
+
+    def near_duplicate(self, novelty):
+        return 1.0 - novelty >= self.threshold
+
+    def mark_downlinked(self, names):
+        """Flag indexed frames as downlinked, returning how many were not yet"""
+        marked = 0
+        for name in names:
+            idx = self.positions.get(name)
+            if idx is not None and not self.downlinked[idx]:
+                self.downlinked[idx] = True
+                marked += 1
+        return marked
+
+    def pending(self):
+        """Downlink candidates of every frame not downlinked yet, for downlink_plan"""
+        return [
+            (
+                name,
+                size,
+                {
+                    "novelty_score": novelty,
+                    "near_duplicate": self.near_duplicate(novelty),
+                },
+            )
+            for name, size, novelty, downlinked in zip(
+                self.names, self.sizes, self.novelty, self.downlinked
+            )
+            if not downlinked
+        ]
 
-        # Processing time
-        processing_time = time.time() - start_time
-        stats["performance"] = {
-            "processing_time_seconds": processing_time,
-            "pixels_per_second": stats["basic_info"]["total_pixels"] / processing_time,
-            "cuda_used": True,
+    def _reserve(self, rows, dim):
+        if len(self.vectors) >= rows:
+            return
+        grown = np.zeros((max(rows, 2 * len(self.vectors), 64), dim), np.float32)
+        if self.names:
+            grown[: len(self.names)] = self.vectors[: len(self.names)]
+        self.vectors = grown
+
+    def save(self):
+        """Atomically write the index, vectors stored as float16"""
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            names=np.array(self.names, dtype=str),
+            sizes=np.array(self.sizes, dtype=np.int64),
+            novelty=np.array(self.novelty, dtype=np.float32),
+            downlinked=np.array(self.downlinked, dtype=bool),
+            vectors=self.vectors[: len(self.names)].astype(np.float16),
+        )
+        os.replace(tmp_path, self.path)
+
+
+def downlink_plan(candidates, budget_bytes):
+    """Most novel first, near-duplicates last, cut at `budget_bytes`
+
+    `candidates` are (filename, size_bytes, novelty report) tuples. Frames
+    that do not fit are skipped, so smaller ones further down the ranking
+    can still use the budget: near-duplicates only get what the novel
+    frames leave over.
+    """
+    ranked = sorted(
+        candidates,
+        key=lambda c: (c[2]["near_duplicate"], -c[2]["novelty_score"]),
+    )
+    selected = []
+    used = 0
+    for filename, size, report in ranked:
+        if used + size > budget_bytes:
+            continue
+        selected.append(filename)
+        used += size
+    return {
+        "budget_bytes": budget_bytes,
+        "selected_bytes": used,
+        "images": selected,
+        "near_duplicates": [c[0] for c in ranked if c[2]["near_duplicate"]],
+    }
+
+
+def plan_downlinks(index, results, budget_bytes, downlinked_path=DOWNLINKED_PATH):
+    """Index the new frames of `results`, then plan every frame not downlinked
+
+    Frames listed in the JSON file at `downlinked_path` are flagged in the
+    index first. The plan covers the whole index, with the novelty stored
+    when each frame was added, so frames ranked in an earlier run stay
+    planned until they are downlinked. New frames get a "novelty" section.
+    """
+    changed = False
+    if os.path.exists(downlinked_path):
+        try:
+            with open(downlinked_path) as f:
+                changed = index.mark_downlinked(json.load(f)) > 0
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Ignoring {downlinked_path}: {e}")
+
+    new = [
+        (filename, stats, embedding)
+        for filename, stats, embedding in results
+        if filename not in index
+    ]
+    new_near_duplicates = 0
+    if new:
+        reports = index.add(
+            [filename for filename, _, _ in new],
+            [stats["basic_info"]["size_bytes"] for _, stats, _ in new],
+            [embedding for _, _, embedding in new],
+        )
+        for (_, stats, _), report in zip(new, reports):
+            stats["novelty"] = report
+            new_near_duplicates += report["near_duplicate"]
+        changed = True
+    if changed:
+        index.save()
+
+    candidates = index.pending()
+    plan = downlink_plan(candidates, budget_bytes)
+    plan["pending_images"] = len(candidates)
+    plan["new_near_duplicates"] = new_near_duplicates
+    return plan
+
+
+class StageTimer:
+    """Thread-safe accumulator of the time each pipeline stage spends working"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.busy = {}
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.busy[stage] = self.busy.get(stage, 0.0) + seconds
+
+    def report(self, wall_time, workers):
+        """Busy time and utilization of each stage over the pipeline wall time"""
+        return {
+            stage: {
+                "busy_seconds": busy,
+                "workers": workers.get(stage, 1),
+                "utilization": busy / (wall_time * workers.get(stage, 1))
+                if wall_time
+                else 0.0,
+            }
+            for stage, busy in self.busy.items()
         }
 
-        return stats
+
+def run_pipeline(
+    analyzer,
+    images,
+    writer,
+    timer,
+    cache=None,
+    batch_size=BATCH_SIZE,
+    decode_workers=DECODE_WORKERS,
+    queue_depth=QUEUE_DEPTH,
+):
+    """Overlap decoding, GPU analysis and file writes
+
+    A pool of decode workers pulls (filename, bytes) pairs from `images` and
+    pushes decoded frames, in pinned buffers, into a bounded queue. The calling
+    thread drains that queue in batches on the GPU, and raw files are handed
+    to `writer`. Images found in `cache` skip decoding and analysis.
+    Returns a list of (filename, stats, feature_vector) tuples.
+    """
+    decoded_queue = queue.Queue(maxsize=queue_depth)
+    source = iter(images)
+    source_lock = threading.Lock()
+    stop = threading.Event()
+    done = object()
+
+    def decode_worker():
+        try:
+            while not stop.is_set():
+                with source_lock:
+                    item = next(source, None)
+                if item is None:
+                    break
+                filename, img_data = item
+                start = time.perf_counter()
+                cached = cache.get(img_data) if cache is not None else None
+                if cached is not None:
+                    decoded_queue.put((filename, img_data, None, cached))
+                else:
+                    decoded = analyzer.decode(img_data)
+                    decoded_queue.put((filename, img_data, decoded, None))
+                timer.add("decode", time.perf_counter() - start)
+        finally:
+            decoded_queue.put(done)
+
+    results = []
+
+    def analyze(pending):
+        start = time.perf_counter()
+        all_stats, features = analyzer.analyze_decoded(
+            [item[2] for item in pending], start
+        )
+        timer.add("analyze", time.perf_counter() - start)
+        for (filename, img_data, decoded, _), stats, embedding in zip(
+            pending, all_stats, features
+        ):
+            results.append((filename, stats, embedding))
+            writer.submit(os.path.join(OUTPUT_DIR, filename), img_data)
+            if decoded.get("rectified") is not None:
+                # PNG encoding is left to the writer thread
+                path = rectified_path(filename)
+                view = decoded.pop("rectified")
+                writer.submit(path, lambda view=view: encode_png(view))
+                stats["rectified"] = {"path": os.path.relpath(path, OUTPUT_DIR)}
+            if cache is not None:
+                # Serialized here, written by the writer thread
+                cache.put(img_data, stats, embedding, writer=writer)
+
+    with ThreadPoolExecutor(max_workers=decode_workers) as pool:
+        workers = [pool.submit(decode_worker) for _ in range(decode_workers)]
+
+        pending = []
+        finished = 0
+        try:
+            while finished < decode_workers:
+                item = decoded_queue.get()
+                if item is done:
+                    finished += 1
+                    continue
+                filename, img_data, _, cached = item
+                if cached is not None:
+                    stats, embedding = cached
+                    results.append((filename, stats, embedding))
+                    writer.submit(os.path.join(OUTPUT_DIR, filename), img_data)
+                    continue
+                pending.append(item)
+                if len(pending) == batch_size:
+                    analyze(pending)
+                    pending = []
+            if pending:
+                analyze(pending)
+        finally:
+            # Unblock the decode workers if the GPU stage failed
+            stop.set()
+            while finished < decode_workers:
+                if decoded_queue.get() is done:
+                    finished += 1
+
+        # Surface decode errors instead of silently dropping images
+        for worker in workers:
+            worker.result()
+
+    return results
 
 
 def main():
-    insights = {
-        "cuda_info": {
+    # Redirect stdout and stderr to the log file, only when run as the pod's
+    # script: importing the module (e.g. from benchmark.py) has no side effects
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    log_file = open(os.path.join(OUTPUT_DIR, "log.txt"), "w")
+    sys.stdout = log_file
+    sys.stderr = log_file
+    print_banner()
+
+    if ANALYZER_BACKEND == "torch":
+        cuda_info = {
             "available": torch.cuda.is_available(),
             "device_name": torch.cuda.get_device_name(0)
             if torch.cuda.is_available()
             else "CPU",
             "pytorch_version": torch.__version__,
-        },
+        }
+    else:
+        cuda_info = {"available": False, "device_name": "CPU"}
+
+    insights = {
+        "backend": ANALYZER_BACKEND,
+        "cuda_info": cuda_info,
         "total_images_processed": 0,
         "images": {},
     }
 
-    # Initialize CUDA analyzer
-    analyzer = ImageAnalyzer(device)
-
-    # Fetch images
-    zip_data = fetch_recent_images(limit=10)
+    # Initialize the analyzer of the selected backend
+    if ANALYZER_BACKEND == "torch":
+        analyzer = ImageAnalyzer(device)
+        insights["feature_model"] = {
+            "variant": analyzer.model_variant,
+            "load_seconds": analyzer.load_seconds,
+        }
+        print(f"Feature extractor ready in {analyzer.load_seconds:.2f}s")
+    elif ANALYZER_BACKEND == "numpy":
+        analyzer = NumpyImageAnalyzer()
+    else:
+        raise ValueError(f"Unknown ANALYZER_BACKEND: {ANALYZER_BACKEND}")
+    if INSIGHTS_FORMAT not in ("json", "npz", "both"):
+        raise ValueError(f"Unknown INSIGHTS_FORMAT: {INSIGHTS_FORMAT}")
 
-    # Extract and process images
-    images = extract_images(zip_data)
+    # Stream images off the socket one at a time instead of buffering the ZIP
+    manifest = load_manifest()
+    if SYNC_MODE == "incremental":
+        images = sync_images(manifest)
+    elif SYNC_MODE == "archive":
+        images = mapped_images(spool_all_images())
+    else:
+        images = stream_recent_images(limit=IMAGE_LIMIT)
     print(f"\n{'=' * 60}")
-    print(f"Extracted {len(images)} images - Starting GPU Analysis")
+    print(f"Streaming images - Starting {ANALYZER_BACKEND} analysis")
     print(f"{'=' * 60}\n")
 
     total_processing_time = 0
 
-    for idx, (filename, img_data) in enumerate(images, 1):
-        print(f"[{idx}/{len(images)}] Processing {filename}...")
+    # Images analyzed in earlier runs are served from the pod volume
+    cache = None
+    if CACHE_MAX_BYTES > 0:
+        version = f"{ANALYZER_VERSION}-{ANALYZER_BACKEND}"
+        if ANALYZER_BACKEND == "torch":
+            version += f"-{analyzer.model_variant}"
+        if LENS_MASK:
+            version += "-lens"
+        if RECTIFY:
+            version += f"-{analyzer.rectifier.signature()}"
+        cache = ResultCache(CACHE_DIR, version=version)
+        if CACHE_INVALIDATE:
+            print("Invalidating result cache...")
+            cache.clear()
+
+    # Decode, GPU analysis and file writes run concurrently
+    timer = StageTimer()
+    writer = FileWriter(
+        timer, QUEUE_DEPTH, profiler=analyzer.profiler, fsync_batch=FSYNC_BATCH
+    )
+    pipeline_start = time.time()
+    results = run_pipeline(analyzer, images, writer, timer, cache=cache)
+    writer.flush()
+    pipeline_time = time.time() - pipeline_start
+
+    # Record what is on the volume now so the next incremental run skips it
+    for filename, stats, _ in results:
+        manifest[filename] = stats["basic_info"]["size_bytes"]
+    save_manifest(manifest)
+
+    # Compare new frames with every frame seen before, most novel downlinked first
+    plan = None
+    if ANALYZER_BACKEND == "torch":
+        index = EmbeddingIndex(INDEX_PATH)
+        plan = plan_downlinks(index, results, DOWNLINK_BUDGET_BYTES)
+        print(
+            f"Embedding index: {len(index)} frames, "
+            f"{plan['new_near_duplicates']} new near-duplicates, "
+            f"{plan['pending_images']} not downlinked yet\n"
+        )
+
+    # Spacecraft state of every frame, from one telemetry range per capture
+    # pass and data type rather than one query per frame
+    if TELEMETRY_JOIN and results:
+        try:
+            # Needs telemetry_client.py and telemetry_columns.py next to it
+            import frame_telemetry
 
-        # GPU-accelerated analysis
-        stats = analyzer.analyze_cuda(img_data)
+            frames, report = frame_telemetry.frame_telemetry(
+                [filename for filename, _, _ in results],
+                TELEMETRY_API,
+                margin=TELEMETRY_MARGIN,
+                max_gap=TELEMETRY_MAX_GAP,
+            )
+        except (ImportError, OSError, ValueError, RuntimeError) as e:
+            frames, report = {}, {"error": str(e)}
+            print(f"Telemetry join failed: {e}")
+        for filename, stats, _ in results:
+            if filename in frames:
+                stats["telemetry"] = frames[filename]
+        insights["telemetry_join"] = report
+        if "matched" in report:
+            print(
+                f"Telemetry join: {report['matched']['position']}/{report['frames']} "
+                f"frames positioned from {report['records']} records "
+                f"in {report['windows']} capture passes"
+            )
+        if report.get("frames_without_time"):
+            print(
+                f"Telemetry join: {len(report['frames_without_time'])} frames "
+                "have no time of day in their name and were not joined"
+            )
+        print()
+
+    for idx, (filename, stats, _) in enumerate(results, 1):
+        cached = stats["performance"].get("cached", False)
+        suffix = " (cached)" if cached else ""
+        print(f"[{idx}/{len(results)}] Processed {filename}{suffix}")
         insights["images"][filename] = stats
 
-        total_processing_time += stats["performance"]["processing_time_seconds"]
+        if not cached:
+            total_processing_time += stats["performance"]["processing_time_seconds"]
 
         # Print key insights
         print(
@@ -310,6 +1780,20 @@ def main():
         print(f"  ✓ Brightness: {stats['color_analysis']['overall_brightness']:.1f}")
         print(f"  ✓ Edge Density: {stats['edge_analysis']['edge_density']:.2f}")
         print(f"  ✓ Complexity: {stats['edge_analysis']['complexity_score']:.2f}")
+        if "novelty" in stats:
+            report = stats["novelty"]
+            suffix = (
+                f" (near-duplicate of {report['nearest_image']})"
+                if report["near_duplicate"]
+                else ""
+            )
+            print(f"  ✓ Novelty: {report['novelty_score']:.3f}{suffix}")
+        if "position" in stats.get("telemetry", {}):
+            position = stats["telemetry"]["position"]
+            print(
+                f"  ✓ Position: ({position['x']:.1f}, {position['y']:.1f}, "
+                f"{position['z']:.1f}) at {stats['telemetry']['capture_time']}"
+            )
         print(
             f"  ✓ Processing Time: {stats['performance']['processing_time_seconds']:.3f}s"
         )
@@ -317,28 +1801,74 @@ def main():
             f"  ✓ Throughput: {stats['performance']['pixels_per_second'] / 1e6:.2f} Mpx/s\n"
         )
 
-        # Save raw image file
-        img_path = os.path.join(OUTPUT_DIR, filename)
-        with open(img_path, "wb") as f:
-            f.write(img_data)
-
-    insights["total_images_processed"] = len(images)
+    insights["total_images_processed"] = len(results)
     insights["summary"] = {
         "total_processing_time": total_processing_time,
-        "average_time_per_image": total_processing_time / len(images) if images else 0,
+        "average_time_per_image": total_processing_time / len(results)
+        if results
+        else 0,
         "total_throughput_mpx_per_sec": sum(
             i["performance"]["pixels_per_second"] for i in insights["images"].values()
         )
         / 1e6
-        / len(images)
-        if images
+        / len(results)
+        if results
         else 0,
     }
+    if cache is not None:
+        insights["cache"] = {
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "size_bytes": cache.evict(),
+        }
+    insights["pipeline"] = {
+        "wall_time_seconds": pipeline_time,
+        "batch_size": BATCH_SIZE,
+        "decode_workers": DECODE_WORKERS,
+        "queue_depth": QUEUE_DEPTH,
+        "stages": timer.report(pipeline_time, {"decode": DECODE_WORKERS}),
+        # Raw images, rectified views and cache entries saved during the pipeline
+        "writes": writer.report(),
+    }
+    if ANALYZER_BACKEND == "torch":
+        insights["pipeline"]["host_buffers"] = analyzer.buffers.report()
+
+    if plan is not None:
+        insights["downlink_plan"] = plan
+        writer.submit(
+            os.path.join(OUTPUT_DIR, "downlink_plan.json"),
+            json.dumps(plan, indent=2).encode("utf-8"),
+        )
 
-    # Save insights to JSON
-    insights_path = os.path.join(OUTPUT_DIR, "cuda_insights.json")
-    with open(insights_path, "w") as f:
-        json.dump(insights, f, indent=2)
+    # Per-stage timings, before the memory report resets the peak statistics
+    insights["profile"] = analyzer.profiler.report()
+    if analyzer.rectifier is not None:
+        insights["rectification"] = analyzer.rectifier.report(insights["profile"])
+    if PROFILE_TRACE:
+        trace_path = os.path.join(OUTPUT_DIR, "trace.json")
+        analyzer.profiler.save_chrome_trace(trace_path)
+        print(f"Chrome trace saved to: {trace_path}")
+
+    if MEMORY_REPORT and results:
+        largest = max(
+            (stats["basic_info"] for _, stats, _ in results),
+            key=lambda info: info["total_pixels"],
+        )
+        insights["memory_report"] = edge_texture_memory_report(
+            analyzer, largest["height"], largest["width"]
+        )
+
+    # Save insights through the writer, after the raw images
+    outputs = {}
+    if INSIGHTS_FORMAT in ("json", "both"):
+        outputs["cuda_insights.json"] = json.dumps(insights, indent=2).encode("utf-8")
+    if INSIGHTS_FORMAT in ("npz", "both"):
+        embeddings = {filename: embedding for filename, _, embedding in results}
+        outputs["cuda_insights.npz"] = compact_insights.encode(insights, embeddings)
+    for name, data in outputs.items():
+        writer.submit(os.path.join(OUTPUT_DIR, name), data)
+    writer.close()
+    insights_path = ", ".join(os.path.join(OUTPUT_DIR, name) for name in outputs)
 
     print(f"{'=' * 60}")
     print(f"PROCESSING COMPLETE!")
@@ -349,6 +1879,37 @@ def main():
     print(
         f"Average throughput: {insights['summary']['total_throughput_mpx_per_sec']:.2f} Mpx/s"
     )
+    for name, data in outputs.items():
+        print(f"  {name}: {len(data) / 1024:.1f} KB")
+    if cache is not None:
+        print(f"Cache hits: {cache.hits}, misses: {cache.misses}")
+    writes = writer.report()
+    print(
+        f"Files written: {writes['files_written']} ({writes['bytes_written'] / 1e6:.1f} MB), "
+        f"unchanged: {writes['files_skipped']} ({writes['bytes_skipped'] / 1e6:.1f} MB)"
+    )
+    for stage, report in insights["pipeline"]["stages"].items():
+        print(
+            f"  {stage:>7}: {report['busy_seconds']:.2f}s busy, "
+            f"{report['utilization'] * 100:.0f}% utilization"
+        )
+    for stage, report in insights["profile"]["stages"].items():
+        print(
+            f"  {stage:>18}: {report['total_seconds']:.3f}s over "
+            f"{report['calls']} calls ({report['device']})"
+        )
+    if "rectification" in insights:
+        report = insights["rectification"]
+        print(
+            f"Rectification: grids built in {report['grid_build_seconds']:.2f}s, "
+            f"loaded in {report['grid_load_seconds']:.2f}s, "
+            f"{report['remap_ms_per_frame']:.1f} ms per frame"
+        )
+    if "peak_allocated_bytes" in insights["profile"]["memory"]:
+        print(
+            "Peak GPU memory: "
+            f"{insights['profile']['memory']['peak_allocated_bytes'] / 1e6:.1f} MB"
+        )
     print(f"{'=' * 60}\n")
 
 
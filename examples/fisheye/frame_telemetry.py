@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""Spacecraft position, velocity and attitude at the capture time of every frame
+
+Frame times are parsed from the image filenames ("20250603T175514Z.png",
+"2025-06-03_17-55-14.123.png", ...). Names that only carry a date
+("20250603.png") do not say when in the day the frame was taken, so they
+are not joined and are listed in the report instead.
+
+Telemetry is fetched once per capture pass rather than once per frame:
+frames closer than twice the margin share one range of
+TelemetryClient.iter_telemetry per data type, which splits ranges that fill
+a page. The records are turned into NumPy columns by
+telemetry_columns.to_series, and all frames are then interpolated at once:
+
+- position by cubic Hermite interpolation, using the velocity as derivative
+- velocity and angular velocity linearly
+- attitude quaternions by spherical linear interpolation (SLERP)
+
+Frames outside the telemetry, or between two samples further apart than
+`max_gap` seconds, are left without a value instead of being extrapolated.
+By default the gap allowed for each series is GAP_FACTOR times its median
+sample spacing, so it follows the cadence the API actually delivers.
+
+telemetry_client.py and telemetry_columns.py come from examples/telemetry
+and are copied next to this module in the image.
+"""
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from telemetry_client import TelemetryClient, from_us, to_us
+from telemetry_columns import VECTOR_FIELDS, to_series
+
+# Telemetry series holding each interpolated field, and its column there
+SOURCES = {
+    "position": ("position", "position"),
+    "velocity": ("velocity", "velocity"),
+    "quaternion": ("attitude", "quaternion"),
+    "angular_velocity": ("attitude", "angular_velocity"),
+}
+
+# Default largest interpolated gap, in median sample spacings of the series
+GAP_FACTOR = 2.5
+
+FRAME_TIME_PATTERN = re.compile(
+    r"(\d{4})-?(\d{2})-?(\d{2})"
+    r"(?:[T_ -]?(\d{2})[-:]?(\d{2})[-:]?(\d{2})(?:\.(\d{1,6}))?)?Z?"
+)
+
+
+def frame_time(filename):
+    """UTC capture time of a frame in microseconds since the epoch
+
+    None when the name holds no time of day, or no date at all.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    match = FRAME_TIME_PATTERN.fullmatch(stem)
+    if match is None or match.group(4) is None:
+        return None
+    year, month, day, hour, minute, second, fraction = match.groups()
+    try:
+        moment = datetime(
+            int(year),
+            int(month),
+            int(day),
+            int(hour),
+            int(minute),
+            int(second),
+            int((fraction or "0").ljust(6, "0")),
+            tzinfo=timezone.utc,
+        )
+    except ValueError:
+        return None
+    return to_us(moment)
+
+
+def capture_windows(times, margin):
+    """Merge the [t - margin, t + margin] intervals of the frame times"""
+    windows = []
+    for t in np.sort(times):
+        if windows and t - margin <= windows[-1][1]:
+            windows[-1][1] = t + margin
+        else:
+            windows.append([t - margin, t + margin])
+    return windows
+
+
+def fetch_series(client, frame_times, margin, page_size=5000):
+    """{data_type: TelemetrySeries} of the telemetry around the frames, and a report
+
+    `frame_times` and `margin` are in microseconds. "complete" records are
+    fetched instead when a data type has no samples.
+    """
+    windows = capture_windows(frame_times, margin)
+    stats = {"windows": len(windows), "records": 0}
+
+    def records(data_type):
+        for start, end in windows:
+            for record in client.iter_telemetry(
+                from_us(int(start)), from_us(int(end)), data_type, page_size
+            ):
+                stats["records"] += 1
+                yield record
+
+    series = {}
+    for data_type in dict.fromkeys(source for source, _ in SOURCES.values()):
+        series.update(to_series(records(data_type), unpack_complete=False))
+    missing = [source for source, _ in SOURCES.values() if source not in series]
+    if missing:
+        complete = to_series(records("complete"))
+        series.update({name: complete[name] for name in missing if name in complete})
+    return series, stats
+
+
+def samples(series, field, origin):
+    """(seconds since `origin` in microseconds, (n, k) values) of a field
+
+    Rows where a component is missing (NaN) are dropped.
+    """
+    source, column = SOURCES[field]
+    width = len(VECTOR_FIELDS[field])
+    if source not in series or column not in series[source].columns:
+        return np.empty(0), np.empty((0, width))
+    timestamps = series[source].timestamps
+    values = series[source][column].reshape(len(timestamps), width)
+    keep = np.isfinite(values).all(axis=1)
+    return (timestamps[keep] - origin) / 1e6, values[keep]
+
+
+def default_gap(times):
+    """GAP_FACTOR times the median spacing of sorted sample times, inf if unknown"""
+    if len(times) < 2:
+        return np.inf
+    return GAP_FACTOR * float(np.median(np.diff(times)))
+
+
+def single_sample(times, values, query):
+    """Values at the query times of a series of less than two samples"""
+    out = np.full((len(query), values.shape[1]), np.nan)
+    valid = np.isin(query, times)
+    if len(times):
+        out[valid] = values[0]
+    return out, valid
+
+
+def bracket(times, query, max_gap):
+    """Indices of the samples around each query time, weights and validity"""
+    i1 = np.clip(np.searchsorted(times, query, side="right"), 1, len(times) - 1)
+    i0 = i1 - 1
+    dt = times[i1] - times[i0]
+    w = (query - times[i0]) / dt
+    valid = (query >= times[0]) & (query <= times[-1]) & (dt <= max_gap)
+    return i0, i1, w, dt, valid
+
+
+def lerp(times, values, query, max_gap):
+    if len(times) < 2:
+        return single_sample(times, values, query)
+    i0, i1, w, _, valid = bracket(times, query, max_gap)
+    return values[i0] + w[:, None] * (values[i1] - values[i0]), valid
+
+
+def hermite(times, positions, velocities, query, max_gap):
+    """Cubic Hermite interpolation of positions whose derivatives are known"""
+    if len(times) < 2:
+        return single_sample(times, positions, query)
+    i0, i1, w, dt, valid = bracket(times, query, max_gap)
+    w2, w3 = w * w, w * w * w
+    h00 = 2 * w3 - 3 * w2 + 1
+    h10 = w3 - 2 * w2 + w
+    h01 = -2 * w3 + 3 * w2
+    h11 = w3 - w2
+    return (
+        h00[:, None] * positions[i0]
+        + (h10 * dt)[:, None] * velocities[i0]
+        + h01[:, None] * positions[i1]
+        + (h11 * dt)[:, None] * velocities[i1]
+    ), valid
+
+
+def slerp(times, quaternions, query, max_gap):
+    """Spherical linear interpolation of unit quaternions (w, x, y, z)"""
+    if len(times) < 2:
+        return single_sample(times, quaternions, query)
+    i0, i1, w, _, valid = bracket(times, query, max_gap)
+    q0 = quaternions[i0] / np.linalg.norm(quaternions[i0], axis=1, keepdims=True)
+    q1 = quaternions[i1] / np.linalg.norm(quaternions[i1], axis=1, keepdims=True)
+    # q and -q are the same rotation: take the shorter arc
+    dot = np.sum(q0 * q1, axis=1)
+    q1 = np.where(dot[:, None] < 0, -q1, q1)
+    dot = np.clip(np.abs(dot), 0.0, 1.0)
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    # Nearly identical rotations fall back to a normalized linear blend
+    close = sin_theta < 1e-6
+    safe = np.where(close, 1.0, sin_theta)
+    s0 = np.where(close, 1 - w, np.sin((1 - w) * theta) / safe)
+    s1 = np.where(close, w, np.sin(w * theta) / safe)
+    out = s0[:, None] * q0 + s1[:, None] * q1
+    return out / np.linalg.norm(out, axis=1, keepdims=True), valid
+
+
+def interpolate(series, query, max_gaps):
+    """{field: (values, valid)} at the query times, in one pass per field
+
+    `series` maps each field to its (times, values) samples, and `max_gaps`
+    to the largest gap interpolated across, in the same unit as `query`.
+    Positions are Hermite interpolated between samples whose velocity is
+    known, linearly otherwise. Also returns the number of Hermite frames.
+    """
+    results = {}
+    position_times, positions = series["position"]
+    velocity_times, velocities = series["velocity"]
+    max_gap = max_gaps["position"]
+    results["position"] = lerp(position_times, positions, query, max_gap)
+    hermite_frames = 0
+    if len(position_times) >= 2 and len(velocity_times):
+        # Velocity at the position samples, the derivatives of the spline
+        derivatives, known = lerp(velocity_times, velocities, position_times, np.inf)
+        derivatives[~known] = 0.0
+        smooth, valid = hermite(position_times, positions, derivatives, query, max_gap)
+        i0, i1, _, _, _ = bracket(position_times, query, max_gap)
+        use = known[i0] & known[i1]
+        linear, _ = results["position"]
+        results["position"] = np.where(use[:, None], smooth, linear), valid
+        hermite_frames = int((use & valid).sum())
+    results["velocity"] = lerp(velocity_times, velocities, query, max_gaps["velocity"])
+    results["quaternion"] = slerp(*series["quaternion"], query, max_gaps["quaternion"])
+    results["angular_velocity"] = lerp(
+        *series["angular_velocity"], query, max_gaps["angular_velocity"]
+    )
+    return results, hermite_frames
+
+
+def frame_telemetry(filenames, api_url, margin=300.0, max_gap=None):
+    """{filename: telemetry at capture time} of the frames, and a report
+
+    `api_url` is the base URL of the Telemetry API. Each frame with a capture
+    time gets a {"capture_time", "position", "velocity", "quaternion",
+    "angular_velocity"} dict holding the series that could be interpolated,
+    vectors as {"x", "y", "z"} (or {"w", "x", "y", "z"}) dicts. Frames whose
+    name has no time of day are listed under "frames_without_time".
+    `max_gap` (seconds) defaults to default_gap() of each series.
+    """
+    report = {"frames": len(filenames), "margin_seconds": margin}
+    named = [(name, frame_time(name)) for name in filenames]
+    report["frames_without_time"] = [name for name, t in named if t is None]
+    named = [(name, t) for name, t in named if t is not None]
+    report["frames_with_time"] = len(named)
+    if not named:
+        return {}, report
+
+    frame_times = np.array([t for _, t in named], dtype=np.int64)
+    start = time.time()
+    with TelemetryClient(api_url) as client:
+        series, stats = fetch_series(client, frame_times, int(margin * 1e6))
+    report["fetch_seconds"] = time.time() - start
+    report.update(stats)
+
+    # Seconds since the first frame, small enough to keep float64 precision
+    origin = int(frame_times.min())
+    fields = {field: samples(series, field, origin) for field in SOURCES}
+    report["samples"] = {field: len(times) for field, (times, _) in fields.items()}
+    max_gaps = {
+        field: default_gap(times) if max_gap is None else max_gap
+        for field, (times, _) in fields.items()
+    }
+    report["max_gap_seconds"] = {
+        field: gap if np.isfinite(gap) else None for field, gap in max_gaps.items()
+    }
+    start = time.time()
+    query = (frame_times - origin) / 1e6
+    results, report["hermite_frames"] = interpolate(fields, query, max_gaps)
+    report["interpolate_seconds"] = time.time() - start
+    report["matched"] = {name: int(valid.sum()) for name, (_, valid) in results.items()}
+
+    frames = {}
+    for row, (name, t) in enumerate(named):
+        frame = {"capture_time": from_us(t).isoformat()}
+        for field, (values, valid) in results.items():
+            if valid[row]:
+                frame[field] = dict(zip(VECTOR_FIELDS[field], values[row].tolist()))
+        frames[name] = frame
+    return frames, report
@@ -0,0 +1,567 @@
+"""Image transfer and storage shared by the fisheye analyzers
+
+Used by fisheye.py and by the stdlib analyzer of examples/em-api/fisheye-api,
+so both fetch, cache and save images the same way:
+
+- fetching images from /api/images, streamed entry by entry out of the ZIP
+  response, or spooled to the volume and memory-mapped
+- the manifest of the images already on the volume, for incremental syncs
+- ResultCache, per-image results keyed by content hash
+- FileWriter, a background thread saving files atomically
+
+Only the standard library is used, so the module runs on every node.
+"""
+import contextlib
+import hashlib
+import io
+import json
+import mmap
+import os
+import queue
+import shutil
+import struct
+import threading
+import time
+import urllib.request
+import zipfile
+import zlib
+
+API_BASE = "http://satellite-telemetry.dphi-tm/api/images"
+OUTPUT_DIR = "/data"
+IMAGE_LIMIT = int(os.environ.get("IMAGE_LIMIT", "10"))
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, "manifest.json")
+SPOOL_PATH = os.path.join(OUTPUT_DIR, "images_archive.zip")
+
+
+def fetch_image_list():
+    """Fetch list of available images"""
+    print("Fetching image list...")
+    req = urllib.request.Request(f"{API_BASE}/list")
+    with urllib.request.urlopen(req) as response:
+        data = response.read()
+        return json.loads(data)
+
+
+def fetch_specific_images(image_names):
+    """Fetch specific images as ZIP"""
+    print(f"Fetching {len(image_names)} images...")
+    payload = json.dumps({"images": image_names}).encode("utf-8")
+    req = urllib.request.Request(
+        API_BASE, data=payload, headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(req) as response:
+        return response.read()
+
+
+def fetch_recent_images(limit=10):
+    """Fetch recent images with limit"""
+    print(f"Fetching {limit} recent images...")
+    payload = json.dumps({"limit": limit}).encode("utf-8")
+    req = urllib.request.Request(
+        API_BASE, data=payload, headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(req) as response:
+        return response.read()
+
+
+def extract_images(zip_data):
+    """Extract images from ZIP data"""
+    images = []
+    with zipfile.ZipFile(io.BytesIO(zip_data)) as zf:
+        for filename in zf.namelist():
+            if filename.lower().endswith((".png", ".jpg", ".jpeg")):
+                with zf.open(filename) as img_file:
+                    img_data = img_file.read()
+                    images.append((filename, img_data))
+    return images
+
+
+ZIP_LOCAL_HEADER = b"PK\x03\x04"
+ZIP_CENTRAL_HEADER = b"PK\x01\x02"
+ZIP_END_OF_CENTRAL_DIR = b"PK\x05\x06"
+ZIP_DATA_DESCRIPTOR = b"PK\x07\x08"
+
+
+class ZipStreamReader:
+    """Sequential reader over a non-seekable stream such as an HTTP response"""
+
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def _fill(self, n):
+        while len(self.buffer) < n:
+            chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                return False
+            self.buffer += chunk
+        return True
+
+    def peek(self, n):
+        self._fill(n)
+        return bytes(self.buffer[:n])
+
+    def read(self, n):
+        """Read exactly n bytes"""
+        head = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        parts = [head]
+        remaining = n - len(head)
+        while remaining:
+            chunk = self.stream.read(remaining)
+            if not chunk:
+                raise EOFError("ZIP stream ended in the middle of an entry")
+            parts.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(parts) if len(parts) > 1 else head
+
+    def read_chunk(self):
+        """Read whatever is buffered, or the next chunk of the stream"""
+        if self.buffer:
+            data = bytes(self.buffer)
+            self.buffer.clear()
+            return data
+        return self.stream.read(self.chunk_size)
+
+    def unread(self, data):
+        self.buffer[:0] = data
+
+
+def _read_stored_until_descriptor(reader):
+    """Read a STORED entry whose size is only given in the trailing data descriptor"""
+    data = bytearray()
+    search_from = 0
+    while True:
+        idx = data.find(ZIP_DATA_DESCRIPTOR, search_from)
+        if idx == -1:
+            chunk = reader.read_chunk()
+            if not chunk:
+                raise EOFError("ZIP stream ended before the data descriptor")
+            search_from = max(0, len(data) - 3)
+            data += chunk
+            continue
+        if len(data) < idx + 24:
+            chunk = reader.read_chunk()
+            if chunk:
+                data += chunk
+                continue
+        # The signature may also appear inside the image: only accept it when
+        # the recorded size and CRC match the bytes read so far
+        for fmt, length in (("<III", 16), ("<IQQ", 24)):
+            if len(data) < idx + length:
+                continue
+            crc, size, _ = struct.unpack(fmt, data[idx + 4 : idx + length])
+            if size == idx and zlib.crc32(data[:idx]) == crc:
+                reader.unread(data[idx + length :])
+                return bytes(data[:idx])
+        search_from = idx + 1
+
+
+def _read_deflated(reader):
+    """Inflate an entry chunk by chunk, pushing back the bytes that follow it"""
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    parts = []
+    while not inflater.eof:
+        chunk = reader.read_chunk()
+        if not chunk:
+            raise EOFError("ZIP stream ended in the middle of a deflated entry")
+        parts.append(inflater.decompress(chunk))
+    reader.unread(inflater.unused_data)
+    return b"".join(parts)
+
+
+def iter_zip_entries(stream):
+    """Yield (filename, bytes) for each entry of a ZIP archive read front to back
+
+    Only local file headers are used, so the archive never has to be held in
+    memory or seeked: peak memory is set by the largest single entry.
+    """
+    reader = ZipStreamReader(stream)
+    while True:
+        signature = reader.peek(4)
+        if signature in (ZIP_CENTRAL_HEADER, ZIP_END_OF_CENTRAL_DIR, b""):
+            return
+        if signature != ZIP_LOCAL_HEADER:
+            raise ValueError(f"Unexpected data in ZIP stream: {reader.peek(200)!r}")
+
+        header = reader.read(30)
+        flags, method = struct.unpack("<HH", header[6:10])
+        (compressed_size,) = struct.unpack("<I", header[18:22])
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        name = reader.read(name_length)
+        extra = reader.read(extra_length)
+        filename = name.decode("utf-8" if flags & 0x800 else "cp437")
+
+        # ZIP64 entries keep their real sizes in an extra field
+        if compressed_size == 0xFFFFFFFF:
+            pos = 0
+            while pos + 4 <= len(extra):
+                header_id, size = struct.unpack("<HH", extra[pos : pos + 4])
+                if header_id == 0x0001:
+                    _, compressed_size = struct.unpack(
+                        "<QQ", extra[pos + 4 : pos + 20]
+                    )
+                    break
+                pos += 4 + size
+
+        has_descriptor = flags & 0x08
+        if method == 8:
+            data = _read_deflated(reader)
+        elif method != 0:
+            raise ValueError(f"Unsupported ZIP compression method {method}")
+        elif has_descriptor and compressed_size == 0:
+            data = _read_stored_until_descriptor(reader)
+            has_descriptor = False
+        else:
+            data = reader.read(compressed_size)
+
+        if has_descriptor:
+            # Optional signature, CRC and sizes (32 or 64 bits) after the data
+            skip = 4 if reader.peek(4) == ZIP_DATA_DESCRIPTOR else 0
+            following = reader.peek(skip + 16)[skip + 12 :]
+            zip64 = following not in (
+                ZIP_LOCAL_HEADER,
+                ZIP_CENTRAL_HEADER,
+                ZIP_END_OF_CENTRAL_DIR,
+                b"",
+            )
+            reader.read(skip + (20 if zip64 else 12))
+
+        if not filename.endswith("/"):
+            yield filename, data
+
+
+def stream_images(response):
+    """Yield (filename, bytes) for every image of a ZIP response, one at a time"""
+    for filename, img_data in iter_zip_entries(response):
+        if filename.lower().endswith((".png", ".jpg", ".jpeg")):
+            yield filename, img_data
+
+
+def stream_recent_images(limit=10):
+    """Stream recent images straight off the HTTP socket"""
+    print(f"Streaming {limit} recent images...")
+    payload = json.dumps({"limit": limit}).encode("utf-8")
+    req = urllib.request.Request(
+        API_BASE, data=payload, headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(req) as response:
+        yield from stream_images(response)
+
+
+def stream_specific_images(image_names):
+    """Stream specific images, whether they come back zipped or as a raw image"""
+    print(f"Streaming {len(image_names)} images...")
+    payload = json.dumps({"images": image_names}).encode("utf-8")
+    req = urllib.request.Request(
+        API_BASE, data=payload, headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(req) as response:
+        # A single image is sent as-is (e.g. image/png) instead of a ZIP
+        if response.headers.get_content_type().startswith("image/"):
+            yield image_names[0], response.read()
+        else:
+            yield from stream_images(response)
+
+
+def spool_all_images(path=SPOOL_PATH):
+    """Download the ZIP of every image to `path` without holding it in memory"""
+    print(f"Spooling every image to {path}...")
+    req = urllib.request.Request(
+        API_BASE, data=b"{}", headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(req) as response, open(path + ".tmp", "wb") as f:
+        shutil.copyfileobj(response, f, 1024 * 1024)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def mapped_images(path):
+    """Yield (filename, memoryview) for every image of a ZIP archive on disk
+
+    The archive is memory-mapped and STORED entries are served as slices of
+    the map, so image bytes are only paged in from disk when they are read
+    and the archive can be larger than the available RAM. Deflated entries
+    are inflated into bytes.
+    """
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as f:
+        # The map keeps its own handle and lives as long as any slice of it
+        archive = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(archive, "madvise"):
+        archive.madvise(mmap.MADV_SEQUENTIAL)
+    view = memoryview(archive)
+
+    # The central directory gives every entry; the local header only adds
+    # the length of its name and extra field before the data
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            if not info.filename.lower().endswith((".png", ".jpg", ".jpeg")):
+                continue
+            if info.compress_type != zipfile.ZIP_STORED:
+                yield info.filename, zf.read(info)
+                continue
+            name_length, extra_length = struct.unpack_from(
+                "<HH", archive, info.header_offset + 26
+            )
+            start = info.header_offset + 30 + name_length + extra_length
+            yield info.filename, view[start : start + info.compress_size]
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """Load the {filename: size} map of images already synced to OUTPUT_DIR"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def missing_images(available, manifest, limit=IMAGE_LIMIT):
+    """Most recent available images that are not on the volume yet"""
+    missing = []
+    for filename in sorted(available, reverse=True):
+        path = os.path.join(OUTPUT_DIR, filename)
+        if filename in manifest and os.path.isfile(path):
+            if os.path.getsize(path) == manifest[filename]:
+                continue
+        missing.append(filename)
+    return missing[:limit]
+
+
+def sync_images(manifest, limit=IMAGE_LIMIT):
+    """Stream only the images listed by the API that the manifest lacks"""
+    listing = fetch_image_list()
+    if not listing.get("success"):
+        raise RuntimeError(f"Failed to list images: {listing.get('error')}")
+
+    missing = missing_images(listing["data"], manifest, limit)
+    print(f"{len(listing['data'])} images available, {len(missing)} to sync")
+    if missing:
+        yield from stream_specific_images(missing)
+
+
+class ResultCache:
+    """Per-image results on the pod volume, keyed by content hash and version
+
+    Each entry is a `<key>.json` stats file, plus any other `<key>.<ext>`
+    files an analyzer stores next to it. Entries are evicted least recently
+    used first once the cache grows over `max_bytes`.
+    """
+
+    def __init__(self, directory, version, max_bytes):
+        self.directory = directory
+        self.version = version
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, img_data):
+        return f"{hashlib.sha256(img_data).hexdigest()}-{self.version}"
+
+    def get(self, img_data):
+        """Return the entry of a known image, None otherwise"""
+        path = os.path.join(self.directory, self.key(img_data))
+        try:
+            entry = self.load(path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        # Refresh the access time used by the eviction
+        os.utime(path + ".json")
+        with self.lock:
+            self.hits += 1
+        return entry
+
+    def load(self, path):
+        """Entry stored under `path`, here the stats of its .json file"""
+        with open(path + ".json") as f:
+            return json.load(f)
+
+    def put(self, img_data, stats, writer=None):
+        self.store(img_data, [(".json", json.dumps(stats).encode("utf-8"))], writer)
+
+    def store(self, img_data, files, writer=None):
+        """Write the (extension, data) files of an entry, through `writer` if given
+
+        `data` is bytes or a callable producing them. The .json file should
+        come last, so a visible entry always has its other files.
+        """
+        path = os.path.join(self.directory, self.key(img_data))
+        for extension, data in files:
+            if writer is not None:
+                writer.submit(path + extension, data)
+                continue
+            with open(path + extension + ".tmp", "wb") as f:
+                f.write(data() if callable(data) else data)
+            os.replace(path + extension + ".tmp", path + extension)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        entries = {}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            key = name.split(".", 1)[0]
+            size, last_used, paths = entries.get(key, (0, 0.0, []))
+            st = os.stat(path)
+            if name.endswith(".json"):
+                last_used = st.st_mtime
+            entries[key] = (size + st.st_size, last_used, paths + [path])
+
+        total = sum(size for size, _, _ in entries.values())
+        for size, _, paths in sorted(entries.values(), key=lambda e: e[1]):
+            if total <= self.max_bytes:
+                break
+            for path in paths:
+                os.remove(path)
+            total -= size
+        return total
+
+
+class FileWriter:
+    """Background thread persisting files so the analysis never blocks on I/O
+
+    Files are written to a temporary name and renamed into place, so readers
+    never see a partial file. Files already on the volume with the same size
+    and SHA-256 are left untouched, which saves rewriting the images of
+    earlier runs. With `fsync_batch`, written files are flushed to the
+    storage every `fsync_batch` files and when the writer is closed.
+
+    `timer` (with an add(stage, seconds) method) accumulates the time spent
+    writing, and `profiler` (with a stage(name) context manager) times the
+    encode, write and fsync steps; both are optional.
+    """
+
+    def __init__(self, timer=None, queue_depth=8, profiler=None, fsync_batch=0):
+        self.timer = timer
+        self.profiler = profiler
+        self.fsync_batch = fsync_batch
+        self.unsynced = []
+        self.stats = {
+            "files_written": 0,
+            "bytes_written": 0,
+            "files_skipped": 0,
+            "bytes_skipped": 0,
+            "fsyncs": 0,
+        }
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.errors = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, path, data):
+        """Queue `data` for `path`, either bytes or a callable producing them"""
+        self.queue.put((path, data))
+
+    def flush(self):
+        """Block until every submitted file has been written"""
+        self.queue.join()
+
+    def close(self):
+        """Flush pending writes, stop the writer thread and re-raise its first error
+
+        Every failed write has already been printed when it happened.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.errors:
+            if len(self.errors) > 1:
+                print(f"{len(self.errors)} files could not be written")
+            raise self.errors[0]
+
+    def report(self):
+        """Bytes written and skipped so far; call after flush() or close()"""
+        return dict(self.stats)
+
+    def _stage(self, name):
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.stage(name)
+
+    def _unchanged(self, path, data):
+        try:
+            if os.path.getsize(path) != len(data):
+                return False
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        except OSError:
+            return False
+        return digest.digest() == hashlib.sha256(data).digest()
+
+    def _write(self, path, data):
+        if callable(data):
+            with self._stage("encode"):
+                data = data()
+        if self._unchanged(path, data):
+            self.stats["files_skipped"] += 1
+            self.stats["bytes_skipped"] += len(data)
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._stage("file_write"):
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        self.stats["files_written"] += 1
+        self.stats["bytes_written"] += len(data)
+        if self.fsync_batch > 0:
+            self.unsynced.append(path)
+            if len(self.unsynced) >= self.fsync_batch:
+                self._sync()
+
+    def _sync(self):
+        """fsync the files written since the last batch, then their directories"""
+        with self._stage("fsync"):
+            for path in self.unsynced + sorted(
+                {os.path.dirname(path) for path in self.unsynced}
+            ):
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        self.stats["fsyncs"] += 1
+        self.unsynced = []
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                try:
+                    if self.unsynced:
+                        self._sync()
+                except OSError as e:
+                    print(f"Failed to sync written files: {e}")
+                    self.errors.append(e)
+                self.queue.task_done()
+                break
+            path, data = item
+            start = time.perf_counter()
+            try:
+                self._write(path, data)
+            except Exception as e:
+                # Keep draining the queue so producers never block on a dead
+                # writer, whatever failed: encoding, the write or the fsync
+                print(f"Failed to write {path}: {e!r}")
+                self.errors.append(e)
+            if self.timer is not None:
+                self.timer.add("write", time.perf_counter() - start)
+            self.queue.task_done()
@@ -1,6 +1,7 @@
 import os
 from datetime import datetime, timezone, timedelta
 import base64
+import glob
 import json
 import requests
 import time
@@ -321,16 +322,35 @@ def pod_status(pod_name=""):
 
 
 if __name__ == "__main__":
+    # The build context mirrors examples/: fisheye/ and telemetry/ side by side,
+    # with the weights at the root of the volume where fisheye.py loads them
     print(
         uplink(
             [
                 "Dockerfile",
+                "requirements.txt",
                 "fisheye.py",
-                "resnet18-f37072fd.pth",
-            ]
+                "image_io.py",
+                "compact_insights.py",
+                "frame_telemetry.py",
+                "export_model.py",
+                "benchmark.py",
+            ],
+            dest_path="fisheye",
         )
     )
-    print(image_build("Dockerfile", "fisheye-analysis", "."))
+    print(uplink(glob.glob("wheels/*.whl"), dest_path="fisheye/wheels"))
+    print(
+        uplink(
+            [
+                "../telemetry/telemetry_client.py",
+                "../telemetry/telemetry_columns.py",
+            ],
+            dest_path="telemetry",
+        )
+    )
+    print(uplink(["resnet18-f37072fd.pth"]))
+    print(image_build("fisheye/Dockerfile", "fisheye-analysis", "."))
     print(run("fisheye-analysis", "GPU", 2))
     time.sleep(5)
     print(pod_status())
@@ -0,0 +1,79 @@
+"""Tests of the fisheye pipeline helpers, on the torch-free numpy backend
+
+    python -m pytest examples/fisheye
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+os.environ.setdefault("ANALYZER_BACKEND", "numpy")
+# frame_telemetry imports the telemetry client, copied next to it in the image
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "telemetry"))
+
+import fisheye  # noqa: E402
+import frame_telemetry  # noqa: E402
+
+
+def frames(count, seed=0):
+    """(filename, stats, embedding) results of distinct frames of 1 kB each"""
+    rng = np.random.default_rng(seed)
+    return [
+        (f"2025060{idx}T120000Z.png", {"basic_info": {"size_bytes": 1000}}, vector)
+        for idx, vector in enumerate(rng.normal(size=(count, 16)), 1)
+    ]
+
+
+def test_downlink_plan_survives_reruns(tmp_path):
+    index_path = str(tmp_path / "embedding_index.npz")
+    downlinked_path = str(tmp_path / "downlinked.json")
+    results = frames(4)
+
+    def run():
+        index = fisheye.EmbeddingIndex(index_path)
+        return fisheye.plan_downlinks(index, results, 2500, downlinked_path)
+
+    first = run()
+    assert len(first["images"]) == 2
+    assert first["pending_images"] == 4
+
+    # Every frame is already indexed: the frames not downlinked are planned again
+    second = run()
+    assert second["images"] == first["images"]
+    assert second["pending_images"] == 4
+
+    # Downlinked frames leave the plan, also once the list is gone
+    with open(downlinked_path, "w") as f:
+        json.dump(first["images"], f)
+    third = run()
+    os.remove(downlinked_path)
+    fourth = run()
+    assert third["pending_images"] == fourth["pending_images"] == 2
+    assert fourth["images"]
+    assert not set(fourth["images"]) & set(first["images"])
+
+
+def test_default_gap_follows_the_sample_cadence():
+    # The API delivers about one sample every 132 s, with some jitter
+    rng = np.random.default_rng(0)
+    times = np.cumsum(rng.uniform(128, 136, size=432))
+    values = rng.normal(size=(len(times), 3))
+    series = {
+        "position": (times, values),
+        "velocity": (times, values),
+        "quaternion": (times, np.hstack([np.ones((len(times), 1)), values])),
+        "angular_velocity": (times, values),
+    }
+    query = (times[:-1] + times[1:]) / 2
+    max_gaps = {
+        field: frame_telemetry.default_gap(t) for field, (t, _) in series.items()
+    }
+    assert 300 < max_gaps["position"] < 360
+
+    results, _ = frame_telemetry.interpolate(series, query, max_gaps)
+    assert all(valid.all() for _, valid in results.values())
+
+    # A gap of 120 s, shorter than the cadence, matched nothing
+    results, _ = frame_telemetry.interpolate(series, query, dict.fromkeys(series, 120))
+    assert not any(valid.any() for _, valid in results.values())
@@ -0,0 +1,35 @@
+"""Tests of the image transfer and storage helpers shared by the analyzers
+
+    python -m pytest examples/fisheye
+"""
+import threading
+
+from image_io import FileWriter
+
+
+def test_file_writer_survives_non_os_errors(tmp_path):
+    def broken():
+        raise ValueError("cannot encode this array")
+
+    writer = FileWriter(queue_depth=1)
+    outcome = {}
+
+    def produce():
+        # More failing files than the queue holds: a dead writer would block
+        for idx in range(4):
+            writer.submit(str(tmp_path / f"broken-{idx}.png"), broken)
+        writer.submit(str(tmp_path / "good.bin"), b"payload")
+        try:
+            writer.close()
+        except ValueError as e:
+            outcome["error"] = e
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    producer.join(timeout=10)
+
+    assert not producer.is_alive(), "the writer stopped draining its queue"
+    assert isinstance(outcome.get("error"), ValueError)
+    assert len(writer.errors) == 4
+    assert (tmp_path / "good.bin").read_bytes() == b"payload"
+    assert writer.report()["files_written"] == 1
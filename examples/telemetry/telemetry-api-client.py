@@ -1,10 +1,9 @@
 import os
-import csv
 import json
-import socket
-import time
-import requests
-from datetime import datetime, timedelta, timezone
+from datetime import timedelta
+from functools import partial
+from telemetry_client import TelemetryClient
+from telemetry_store import TelemetryStore
 
 environment = os.getenv("ENVIRONMENT")
 
@@ -12,81 +11,98 @@ if environment == "DOCKER":
     API_HOST = "satellite-telemetry.dphi-tm"
     print("Running inside a Docker Container")
     OUTPUT_FILE = "/app/data/telemetry-docker.json"
+    STORE_FILE = "/app/data/telemetry-docker.sqlite"
 else:
     API_HOST = "localhost"
     print("Running natively")
     OUTPUT_FILE = "telemetry-native.json"
+    STORE_FILE = "telemetry-native.sqlite"
 API_PORT = 8000
-
-
-def fetch_from_api(api_host=API_HOST, api_port=API_PORT, output_file=OUTPUT_FILE):
+# Maximum number of endpoint queries in flight at once
+SNAPSHOT_CONCURRENCY = int(os.getenv("SNAPSHOT_CONCURRENCY", "8"))
+# Queries saved to the output file, with the label they are printed under
+SNAPSHOT_QUERIES = {
+    "latest": "Latest data",
+    "stats": "Stats",
+    "types": "Types",
+    "telemetry": "Position",
+}
+
+
+def report_retry(attempt, error, delay):
+    print(f"DB is setting up. Could not fetch data yet ({error})...")
+    if environment != "DOCKER" and attempt == 1:
+        print("Have you run the docker compose already?")
+    print(f"Retrying in {delay:.1f}s")
+
+
+def fetch_from_api(
+    api_host=API_HOST,
+    api_port=API_PORT,
+    output_file=OUTPUT_FILE,
+    store_file=STORE_FILE,
+):
     """Fetch telemetry data from REST API and save to file."""
     base_url = f"http://{api_host}:{api_port}"
 
-    try:
-        all_data = {}
-
-        print("Fetching health status...")
-        while True:
-            try:
-                response = requests.get(f"{base_url}/health")
-                if response.ok:
-                    all_data["health"] = response.json()
-                    print(f"Health: {response.json()}")
-                    break
-            except:
-                print("DB is setting up. Could not fetch data yet...")
-                if environment != "DOCKER":
-                    print("Have you run the docker compose already?")
-                time.sleep(3)
-
-        print("\n\n\nFetching latest telemetry...")
-        response = requests.get(f"{base_url}/api/telemetry/latest")
-        all_data["latest"] = response.json()
-        print(f"Latest data: {json.dumps(response.json(), indent=2)}")
-
-        print("\n\n\nFetching statistics...")
-        response = requests.get(f"{base_url}/api/telemetry/stats")
-        all_data["stats"] = response.json()
-        print(f"Stats: {json.dumps(response.json(), indent=2)}")
-
-        print("\n\n\nFetching data types...")
-        response = requests.get(f"{base_url}/api/telemetry/types")
-        all_data["types"] = response.json()
-        print(f"Types: {response.json()}")
-
-        print("\n\n\nFetching latest positional telemetry data point...")
-        response = requests.get(f"{base_url}/api/telemetry/latest?data_type=position")
-        all_data["telemetry"] = response.json()
-        print(f"Position: {json.dumps(response.json(), indent=2)}")
-
-        end_time = datetime.now(timezone.utc)
-        start_time = end_time - timedelta(days=100000)
-
-        start_str = start_time.isoformat()
-        end_str = end_time.isoformat()
-
-        print("\n\n\nFetching positional telemetry data between times...")
-
-        params = {"data_type": "position", "start_time": start_str, "end_time": end_str}
-
-        response = requests.get(f"{base_url}/api/telemetry/latest", params=params)
-
-        print("HTTP Status:", response.status_code)
-        print("Raw response text:\n", response.text)
-
+    # All requests below share the keep-alive connections of one session
+    with TelemetryClient(base_url) as client:
         try:
-            data = response.json()
-            print(json.dumps(data, indent=2))
-        except ValueError:
-            print("Error: Response is not valid JSON.")
-
-        with open(output_file, "w") as f:
-            json.dump(all_data, f, indent=2)
-        print(f"\n\n\nData saved to {output_file}")
-
-    except Exception as e:
-        print(f"Error fetching from API: {e}")
+            all_data = {}
+
+            print("Fetching health status...")
+            all_data["health"] = client.wait_until_ready(on_retry=report_retry)
+            print(f"Health: {all_data['health']}")
+
+            # The queries are independent: run them concurrently, so the
+            # snapshot takes about as long as the slowest one
+            queries = {
+                "latest": client.latest,
+                "stats": client.stats,
+                "types": client.types,
+                "telemetry": partial(client.latest, data_type="position"),
+            }
+            print(f"\n\n\nFetching {len(queries)} endpoints concurrently...")
+            results, report = client.snapshot(
+                queries, max_concurrency=SNAPSHOT_CONCURRENCY
+            )
+            for name, query in report["queries"].items():
+                status = f"failed: {query['error']}" if "error" in query else "ok"
+                print(f"  {name:>9}: {query['seconds'] * 1000:.0f} ms, {status}")
+            print(f"Snapshot wall time: {report['wall_time_seconds'] * 1000:.0f} ms")
+
+            for name, label in SNAPSHOT_QUERIES.items():
+                if name in results:
+                    all_data[name] = results[name]
+                    print(f"\n\n\n{label}: {json.dumps(results[name], indent=2)}")
+
+            # Only the records newer than the local copy are downloaded
+            print(f"\n\n\nSyncing the local telemetry store {store_file}...")
+            with TelemetryStore(store_file) as store:
+                added = store.sync(client)
+                for data_type, count in added.items():
+                    print(
+                        f"  {data_type}: {count} new records, "
+                        f"{store.count(data_type)} stored"
+                    )
+
+                # Later reads are answered locally, without calling the API
+                latest = store.latest("position")
+                if latest is not None:
+                    start_time = latest.timestamp - timedelta(days=1)
+                    day = list(store.range(start_time, data_type="position"))
+                    print(
+                        f"\n\n\n{len(day)} positional records in the day up to "
+                        f"{latest.timestamp.isoformat()} (local)"
+                    )
+                    print(f"Latest position: {json.dumps(latest.data, indent=2)}")
+
+            with open(output_file, "w") as f:
+                json.dump(all_data, f, indent=2)
+            print(f"\n\n\nData saved to {output_file}")
+
+        except Exception as e:
+            print(f"Error fetching from API: {e}")
 
 
 if __name__ == "__main__":
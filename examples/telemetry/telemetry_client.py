@@ -0,0 +1,310 @@
+"""Reusable client of the onboard Telemetry API
+
+One TelemetryClient keeps a pooled keep-alive session, so every request of a
+pod reuses the same TCP connections instead of opening a new one per call.
+It has one method per path of docs/2-specs/tlm-api.json:
+
+    from telemetry_client import TelemetryClient
+
+    with TelemetryClient("http://satellite-telemetry.dphi-tm:8000") as client:
+        client.wait_until_ready()
+        position = client.latest(data_type="position")
+"""
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Seconds to wait for each endpoint, as (connect, read) timeouts
+DEFAULT_TIMEOUTS = {
+    "health": (2, 2),
+    "telemetry": (5, 30),
+    "latest": (5, 10),
+    "stats": (5, 10),
+    "tle": (5, 10),
+    "types": (5, 10),
+    "images": (5, 120),
+    "images_list": (5, 10),
+}
+
+# One telemetry data point, with its timestamps parsed to aware datetimes
+TelemetryRecord = namedtuple(
+    "TelemetryRecord",
+    ["id", "timestamp", "original_timestamp", "data_type", "data", "created_at"],
+)
+
+
+def parse_time(value):
+    """Aware datetime of an ISO 8601 string or datetime, naive ones taken as UTC"""
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_us(value):
+    """Integer microseconds since the epoch, which sort and compare exactly"""
+    delta = parse_time(value) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def from_us(value):
+    return datetime.fromtimestamp(value // 1_000_000, timezone.utc).replace(
+        microsecond=value % 1_000_000
+    )
+
+
+def parse_record(record):
+    return TelemetryRecord(
+        record["id"],
+        parse_time(record["timestamp"]),
+        record["original_timestamp"],
+        record["data_type"],
+        record["data"],
+        parse_time(record["created_at"]),
+    )
+
+
+class TelemetryClient:
+    """Client of the Telemetry API sharing one connection pool
+
+    `timeouts` overrides DEFAULT_TIMEOUTS per endpoint, and `pool_size` is the
+    number of connections kept alive for concurrent callers. Responses are
+    the decoded JSON documents ({"success", "data", "error", "count"}),
+    except the TLE text and the image responses; HTTP errors raise
+    requests.HTTPError.
+    """
+
+    def __init__(self, base_url, timeouts=None, pool_size=10):
+        self.base_url = base_url.rstrip("/")
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _request(self, method, path, endpoint, **kwargs):
+        response = self.session.request(
+            method,
+            self.base_url + path,
+            timeout=self.timeouts[endpoint],
+            **kwargs,
+        )
+        response.raise_for_status()
+        return response
+
+    def _get_json(self, path, endpoint, params=None):
+        # Optional query parameters left to None are not sent
+        if params:
+            params = {
+                key: value.isoformat() if isinstance(value, datetime) else value
+                for key, value in params.items()
+                if value is not None
+            }
+        return self._request("GET", path, endpoint, params=params).json()
+
+    def wait_until_ready(
+        self, timeout=None, initial_delay=0.5, max_delay=10.0, on_retry=None
+    ):
+        """Poll /health until the API answers, returning its response
+
+        Retries back off exponentially from `initial_delay` up to `max_delay`
+        seconds with full jitter, so pods started together do not poll in
+        lockstep. Only connection problems and HTTP errors are retried.
+        `on_retry(attempt, error, delay)` is called before each wait. Raises
+        TimeoutError once `timeout` seconds have passed, None waits forever.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        while True:
+            try:
+                return self.health()
+            except (requests.RequestException, ValueError) as e:
+                error = e
+            attempt += 1
+            delay = random.uniform(0, min(max_delay, initial_delay * 2**attempt))
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"Telemetry API not ready after {attempt} attempts: {error}"
+                    )
+                delay = min(delay, remaining)
+            if on_retry is not None:
+                on_retry(attempt, error, delay)
+            time.sleep(delay)
+
+    def snapshot(self, queries, max_concurrency=8):
+        """Run independent queries concurrently, at most `max_concurrency` at once
+
+        `queries` maps a name to a zero-argument callable, for instance
+        {"stats": client.stats, "position": partial(client.latest, "position")}.
+        Returns ({name: result}, report): the report has the latency of every
+        query, the error of the failed ones (left out of the results) and the
+        wall time, which is close to the slowest query rather than the sum.
+        """
+
+        def timed(query):
+            start = time.perf_counter()
+            try:
+                return query(), None, time.perf_counter() - start
+            except (requests.RequestException, ValueError) as e:
+                return None, e, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            futures = {
+                name: pool.submit(timed, query) for name, query in queries.items()
+            }
+            outcomes = {name: future.result() for name, future in futures.items()}
+
+        results = {}
+        report = {"wall_time_seconds": time.perf_counter() - start, "queries": {}}
+        for name, (result, error, seconds) in outcomes.items():
+            report["queries"][name] = {"seconds": seconds}
+            if error is None:
+                results[name] = result
+            else:
+                report["queries"][name]["error"] = str(error)
+        return results, report
+
+    def iter_telemetry(
+        self,
+        start_time=None,
+        end_time=None,
+        data_type=None,
+        page_size=1000,
+        min_window=timedelta(seconds=1),
+    ):
+        """Yield the TelemetryRecords of a time range, oldest first, window by window
+
+        The range is read in windows expected to hold about half a page,
+        estimated from the record counts of /api/telemetry/stats, each
+        requested with `limit=page_size`. A full page may be truncated, so
+        its window is halved and requested again; windows returning less
+        than a quarter of a page are doubled. Only one page is held at a time,
+        so memory does not grow with the history, and the first records are
+        yielded after a single small request. None bounds default to the
+        oldest and newest records.
+        """
+        stats = self.stats().get("data") or {}
+        if not stats.get("earliest_timestamp") or not stats.get("latest_timestamp"):
+            return
+        earliest = parse_time(stats["earliest_timestamp"])
+        latest = parse_time(stats["latest_timestamp"])
+        start = max(parse_time(start_time), earliest) if start_time else earliest
+        end = min(parse_time(end_time), latest) if end_time else latest
+
+        count = stats.get("total_records", 0)
+        if data_type is not None:
+            count = (stats.get("data_type_breakdown") or {}).get(data_type, count)
+        history = max((latest - earliest).total_seconds(), 1.0)
+        window = (
+            timedelta(seconds=history * page_size / 2 / count)
+            if count
+            else end - start
+        )
+        window = max(window, min_window)
+
+        # Both bounds are inclusive: records on a shared bound are skipped the
+        # second time
+        boundary_ids = set()
+        while start <= end:
+            stop = min(start + window, end)
+            response = self.telemetry(start, stop, data_type, limit=page_size)
+            if not response.get("success", True):
+                raise RuntimeError(f"Telemetry query failed: {response.get('error')}")
+            page = response.get("data") or []
+            if len(page) >= page_size and stop - start > min_window:
+                window = max((stop - start) / 2, min_window)
+                continue
+            if len(page) >= page_size:
+                print(
+                    f"Over {page_size} records between {start} and {stop}, "
+                    "some may be missing: raise page_size"
+                )
+
+            records = sorted(
+                (parse_record(record) for record in page), key=lambda r: r.timestamp
+            )
+            # Keep only the parsed records while they are consumed
+            del response, page
+            for record in records:
+                if record.id not in boundary_ids:
+                    yield record
+            boundary_ids = {r.id for r in records if r.timestamp == stop}
+
+            if len(records) < page_size // 4:
+                window *= 2
+            if stop >= end:
+                break
+            start = stop
+
+    def health(self):
+        """GET /health"""
+        return self._get_json("/health", "health")
+
+    def telemetry(self, start_time=None, end_time=None, data_type=None, limit=None):
+        """GET /api/telemetry: records between two times (str or datetime)"""
+        return self._get_json(
+            "/api/telemetry",
+            "telemetry",
+            {
+                "start_time": start_time,
+                "end_time": end_time,
+                "data_type": data_type,
+                "limit": limit,
+            },
+        )
+
+    def latest(self, data_type=None):
+        """GET /api/telemetry/latest: latest record of each type, or of `data_type`"""
+        return self._get_json(
+            "/api/telemetry/latest", "latest", {"data_type": data_type}
+        )
+
+    def stats(self):
+        """GET /api/telemetry/stats"""
+        return self._get_json("/api/telemetry/stats", "stats")
+
+    def tle(self):
+        """GET /api/telemetry/tle: the latest TLE, served as text/plain"""
+        return self._request("GET", "/api/telemetry/tle", "tle").text
+
+    def types(self):
+        """GET /api/telemetry/types"""
+        return self._get_json("/api/telemetry/types", "types")
+
+    def images_list(self):
+        """GET /api/images/list"""
+        return self._get_json("/api/images/list", "images_list")
+
+    def images(self, images=None, limit=None, stream=True):
+        """POST /api/images: a ZIP of the images (or a single raw image)
+
+        Returns the requests.Response, streamed by default so the body can be
+        read incrementally; close it (or use it as a context manager) when done.
+        """
+        payload = {}
+        if images is not None:
+            payload["images"] = list(images)
+        if limit is not None:
+            payload["limit"] = limit
+        return self._request(
+            "POST", "/api/images", "images", json=payload, stream=stream
+        )
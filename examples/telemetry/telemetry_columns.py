@@ -0,0 +1,267 @@
+"""Columnar NumPy form of telemetry time series
+
+TelemetryRecord.data is a nested dict per record, which takes hundreds of
+bytes per sample once there are many of them. to_series() turns a stream of
+records into one TelemetrySeries per data type: an int64 array of
+timestamps (microseconds since the epoch, sorted) and float64 columns, 1-D
+for scalars and (n, k) for vectors:
+
+    position, velocity     (n, 3)  x, y, z
+    quaternion             (n, 4)  w, x, y, z
+    angular_velocity       (n, 3)  x, y, z
+    temperature            (n, 8)  sensor0..sensor7, NaN when missing
+
+Other numeric fields (power, ...) become one scalar column per field.
+Records are consumed one at a time, so the dicts never all exist at once:
+
+    from telemetry_columns import to_series
+
+    series = to_series(store.range(data_type="position"))["position"]
+    window = series.between(start_time, end_time)
+    print(window.times(), window["position"])
+
+Run the module on a store file to compare it with the list of dicts:
+
+    python telemetry_columns.py telemetry-native.sqlite
+"""
+import math
+import sys
+import time
+from array import array
+
+import numpy as np
+
+from telemetry_client import from_us, to_us
+
+# Components of the vector fields, in column order
+VECTOR_FIELDS = {
+    "position": ("x", "y", "z"),
+    "velocity": ("x", "y", "z"),
+    "quaternion": ("w", "x", "y", "z"),
+    "angular_velocity": ("x", "y", "z"),
+    "temperature": tuple(f"sensor{i}" for i in range(8)),
+}
+
+# Parts of a "complete" record, each unpacked into the series of that name
+COMPLETE_PARTS = ("position", "velocity", "attitude", "power", "temperature")
+
+
+def number(value):
+    return float(value) if isinstance(value, (int, float)) else math.nan
+
+
+def fields(name, value):
+    """Yield (column, floats) of the numeric leaves of a field, nested as name.key"""
+    if name in VECTOR_FIELDS and isinstance(value, dict):
+        yield name, [number(value.get(c)) for c in VECTOR_FIELDS[name]]
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from fields(f"{name}.{key}", item)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield name, [float(value)]
+
+
+def record_fields(data_type, data):
+    """fields() of a record's data, whose top-level keys name their columns"""
+    if data_type in VECTOR_FIELDS or not isinstance(data, dict):
+        yield from fields(data_type, data)
+    else:
+        for key, item in data.items():
+            yield from fields(key, item)
+
+
+class SeriesBuilder:
+    """Appends records to compact arrays, NaN-padding columns absent from a row"""
+
+    def __init__(self):
+        self.timestamps = array("q")
+        self.columns = {}
+
+    def add(self, timestamp_us, data_type, data):
+        row = len(self.timestamps)
+        self.timestamps.append(timestamp_us)
+        for column, values in record_fields(data_type, data):
+            if column not in self.columns:
+                self.columns[column] = (len(values), array("d"))
+            width, values_array = self.columns[column]
+            if len(values) != width:
+                continue
+            values_array.extend([math.nan] * (width * row - len(values_array)))
+            values_array.extend(values)
+
+    def build(self):
+        rows = len(self.timestamps)
+        timestamps = np.frombuffer(self.timestamps, dtype=np.int64)
+        columns = {}
+        for column, (width, values_array) in self.columns.items():
+            values_array.extend([math.nan] * (width * rows - len(values_array)))
+            values = np.frombuffer(values_array, dtype=np.float64)
+            columns[column] = values.reshape(rows, width) if width > 1 else values
+
+        # The same sample can come from its own data type and a "complete"
+        # record: sort by time and keep the first row of each timestamp
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        keep = np.ones(rows, dtype=bool)
+        keep[1:] = timestamps[1:] != timestamps[:-1]
+        order = order[keep]
+        return TelemetrySeries(
+            timestamps[keep],
+            {column: values[order] for column, values in columns.items()},
+        )
+
+
+class TelemetrySeries:
+    """Timestamps (int64 microseconds since the epoch, sorted) and their columns"""
+
+    def __init__(self, timestamps, columns):
+        self.timestamps = timestamps
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __repr__(self):
+        columns = ", ".join(
+            f"{name}{values.shape[1:] or ''}" for name, values in self.columns.items()
+        )
+        return f"TelemetrySeries({len(self)} rows: {columns})"
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + sum(v.nbytes for v in self.columns.values())
+
+    def times(self):
+        """The timestamps as datetime64[us], without copying"""
+        return self.timestamps.view("datetime64[us]")
+
+    def between(self, start_time=None, end_time=None):
+        """Rows between two times (inclusive), as views of this series
+
+        The bounds are found by binary search, so a window costs O(log n)
+        whatever the length of the series.
+        """
+        start = (
+            0
+            if start_time is None
+            else np.searchsorted(self.timestamps, to_us(start_time), "left")
+        )
+        stop = (
+            len(self)
+            if end_time is None
+            else np.searchsorted(self.timestamps, to_us(end_time), "right")
+        )
+        return TelemetrySeries(
+            self.timestamps[start:stop],
+            {column: values[start:stop] for column, values in self.columns.items()},
+        )
+
+
+def to_series(records, unpack_complete=True):
+    """{data_type: TelemetrySeries} of a stream of TelemetryRecords
+
+    With `unpack_complete`, the parts of "complete" records are added to the
+    series named after them ("position", "attitude", ...), and null parts
+    are skipped, so sparse power and temperature readings only take rows
+    where they exist. Each series has its own timestamps.
+    """
+    builders = {}
+    for record in records:
+        timestamp_us = to_us(record.timestamp)
+        if unpack_complete and record.data_type == "complete":
+            parts = (
+                [
+                    (part, record.data[part])
+                    for part in COMPLETE_PARTS
+                    if record.data.get(part) is not None
+                ]
+                if isinstance(record.data, dict)
+                else []
+            )
+        elif record.data is not None:
+            parts = [(record.data_type, record.data)]
+        else:
+            parts = []
+        for part, data in parts:
+            builders.setdefault(part, SeriesBuilder()).add(timestamp_us, part, data)
+    return {name: builder.build() for name, builder in builders.items()}
+
+
+def deep_sizeof(value, seen=None):
+    """Bytes taken by an object and everything it references, counted once"""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(
+            deep_sizeof(key, seen) + deep_sizeof(item, seen)
+            for key, item in value.items()
+        )
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_sizeof(item, seen) for item in value)
+    return size
+
+
+def compare(records, queries=200):
+    """Print memory and range query time of the records as dicts and as series"""
+    records = list(records)
+    start = time.perf_counter()
+    series = to_series(records)
+    convert_seconds = time.perf_counter() - start
+    records_bytes = deep_sizeof(records)
+    series_bytes = sum(columns.nbytes for columns in series.values())
+    print(f"{len(records)} records, converted in {convert_seconds:.2f}s")
+    print(
+        f"Memory: {records_bytes / 1e6:.2f} MB as records, "
+        f"{series_bytes / 1e6:.2f} MB as arrays "
+        f"({records_bytes / max(series_bytes, 1):.0f}x smaller)"
+    )
+
+    rng = np.random.default_rng(0)
+    for name, columns in series.items():
+        print(f"\n{name}: {columns!r}")
+        sources = [
+            r
+            for r in records
+            if r.data_type == name
+            or (
+                r.data_type == "complete"
+                and isinstance(r.data, dict)
+                and r.data.get(name)
+            )
+        ]
+        if len(columns) < 2:
+            continue
+
+        # Windows of a tenth of the history at random positions
+        first, last = int(columns.timestamps[0]), int(columns.timestamps[-1])
+        span = (last - first) // 10
+        starts = rng.integers(first, last - span, queries, endpoint=True)
+        windows = [(from_us(int(s)), from_us(int(s) + span)) for s in starts]
+
+        start = time.perf_counter()
+        for s, e in windows:
+            [r for r in sources if s <= r.timestamp <= e]
+        records_seconds = (time.perf_counter() - start) / queries
+        start = time.perf_counter()
+        for s, e in windows:
+            columns.between(s, e)
+        series_seconds = (time.perf_counter() - start) / queries
+        print(
+            f"  range query: {records_seconds * 1e3:.3f} ms scanning records, "
+            f"{series_seconds * 1e3:.3f} ms with searchsorted "
+            f"({records_seconds / series_seconds:.0f}x faster)"
+        )
+
+
+if __name__ == "__main__":
+    from telemetry_store import TelemetryStore
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "telemetry-native.sqlite"
+    with TelemetryStore(path) as store:
+        compare(store.range())
@@ -0,0 +1,169 @@
+"""Local mirror of the onboard telemetry, kept in SQLite
+
+A TelemetryStore keeps the TelemetryRecords already downloaded on the pod
+volume. Each sync only requests the records at or after the newest stored
+timestamp of every data type, and range and latest queries are answered
+from the local file, so scripts can read telemetry without calling the API:
+
+    from telemetry_client import TelemetryClient
+    from telemetry_store import TelemetryStore
+
+    with TelemetryStore("/app/data/telemetry.sqlite") as store:
+        with TelemetryClient("http://satellite-telemetry.dphi-tm:8000") as client:
+            store.sync(client)
+        position = store.latest("position")
+"""
+import json
+import sqlite3
+
+from telemetry_client import TelemetryRecord, from_us, parse_time, to_us
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id TEXT PRIMARY KEY,
+    data_type TEXT NOT NULL,
+    timestamp_us INTEGER NOT NULL,
+    original_timestamp INTEGER,
+    data TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_type_time ON records (data_type, timestamp_us);
+CREATE INDEX IF NOT EXISTS records_time ON records (timestamp_us);
+"""
+
+COLUMNS = "id, data_type, timestamp_us, original_timestamp, data, created_at"
+
+
+def to_row(record):
+    return (
+        record.id,
+        record.data_type,
+        to_us(record.timestamp),
+        record.original_timestamp,
+        json.dumps(record.data),
+        record.created_at.isoformat(),
+    )
+
+
+def from_row(row):
+    id, data_type, timestamp_us, original_timestamp, data, created_at = row
+    return TelemetryRecord(
+        id,
+        from_us(timestamp_us),
+        original_timestamp,
+        data_type,
+        json.loads(data),
+        parse_time(created_at),
+    )
+
+
+class TelemetryStore:
+    """TelemetryRecords in a SQLite file, indexed by (data_type, timestamp)
+
+    Records are deduplicated by id, so overlapping syncs are harmless.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        # WAL lets other pod scripts read while a sync is writing
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def high_water_marks(self):
+        """{data_type: newest stored timestamp}"""
+        rows = self.db.execute(
+            "SELECT data_type, MAX(timestamp_us) FROM records GROUP BY data_type"
+        )
+        return {data_type: from_us(newest) for data_type, newest in rows}
+
+    def add(self, records):
+        """Insert TelemetryRecords, skipping known ids; returns the number added"""
+        with self.db:
+            cursor = self.db.executemany(
+                f"INSERT OR IGNORE INTO records ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                (to_row(record) for record in records),
+            )
+        return cursor.rowcount
+
+    def sync(self, client, data_types=None, batch_size=1000):
+        """Download the records newer than the stored ones, per data type
+
+        `data_types` defaults to the types listed by /api/telemetry/types.
+        Each type is read with client.iter_telemetry from its high-water mark
+        (inclusive, as records sharing that timestamp may have arrived since)
+        and committed every `batch_size` records, so an interrupted sync
+        keeps its progress. Records backdated before the mark are not
+        fetched again. Returns {data_type: number of new records}.
+        """
+        if data_types is None:
+            data_types = client.types().get("data") or []
+        marks = self.high_water_marks()
+        added = {}
+        for data_type in data_types:
+            added[data_type] = 0
+            batch = []
+            for record in client.iter_telemetry(
+                start_time=marks.get(data_type),
+                data_type=data_type,
+                page_size=batch_size,
+            ):
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    added[data_type] += self.add(batch)
+                    batch = []
+            added[data_type] += self.add(batch)
+        return added
+
+    def count(self, data_type=None):
+        if data_type is None:
+            return self.db.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+        return self.db.execute(
+            "SELECT COUNT(*) FROM records WHERE data_type = ?", (data_type,)
+        ).fetchone()[0]
+
+    def range(self, start_time=None, end_time=None, data_type=None):
+        """Yield the stored TelemetryRecords between two times, oldest first
+
+        Both bounds are inclusive, and None leaves that side open.
+        """
+        clauses, params = [], []
+        if data_type is not None:
+            clauses.append("data_type = ?")
+            params.append(data_type)
+        if start_time is not None:
+            clauses.append("timestamp_us >= ?")
+            params.append(to_us(start_time))
+        if end_time is not None:
+            clauses.append("timestamp_us <= ?")
+            params.append(to_us(end_time))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.db.execute(
+            f"SELECT {COLUMNS} FROM records {where} ORDER BY timestamp_us, id", params
+        )
+        for row in rows:
+            yield from_row(row)
+
+    def latest(self, data_type=None):
+        """Newest stored record of `data_type`, or {data_type: record} of all types"""
+        if data_type is not None:
+            row = self.db.execute(
+                f"SELECT {COLUMNS} FROM records WHERE data_type = ? "
+                "ORDER BY timestamp_us DESC LIMIT 1",
+                (data_type,),
+            ).fetchone()
+            return from_row(row) if row else None
+        types = [
+            row[0] for row in self.db.execute("SELECT DISTINCT data_type FROM records")
+        ]
+        return {data_type: self.latest(data_type) for data_type in types}
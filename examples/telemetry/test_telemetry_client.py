@@ -0,0 +1,46 @@
+"""Tests of TelemetryClient against a local stand-in of the Telemetry API
+
+    python -m pytest examples/telemetry
+"""
+import http.server
+import threading
+
+import pytest
+
+from telemetry_client import TelemetryClient
+
+TLE = (
+    "CG2\n"
+    "1 99999U 25001A   25154.50000000  .00001000  00000-0  50000-4 0  9990\n"
+    "2 99999  97.4000 120.0000 0010000  90.0000 270.0000 15.20000000    10\n"
+)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/api/telemetry/tle":
+            self.send_error(404)
+            return
+        body = TLE.encode("ascii")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def client():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with TelemetryClient(f"http://127.0.0.1:{server.server_port}") as client:
+        yield client
+    server.shutdown()
+    server.server_close()
+
+
+def test_tle_returns_the_plain_text_body(client):
+    assert client.tle() == TLE